@@ -1,9 +1,12 @@
 from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, Response
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 import cv2
 import face_recognition
 import numpy as np
 import os
+import sqlite3
 import pickle
 from datetime import datetime, date
 import pandas as pd
@@ -11,18 +14,35 @@ from werkzeug.utils import secure_filename
 import base64
 from io import BytesIO
 from PIL import Image
+from config import Config
+from encoding_store import ENCODING_DIM, EncodingStore, hash_file
+from attendance_recorder import AttendanceRecorder
+from face_tracker import FaceTracker
+from video_pipeline import VideoPipeline
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-change-this'
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///attendance.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['UPLOAD_FOLDER'] = 'static/student_images'
+app.config['ENCODINGS_FOLDER'] = 'encodings'
 
 db = SQLAlchemy(app)
 
+@event.listens_for(Engine, 'connect')
+def configure_sqlite(dbapi_connection, connection_record):
+    """Apply WAL, synchronous and busy-timeout settings to new SQLite connections"""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA busy_timeout={Config.SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA journal_mode={Config.SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={Config.SQLITE_SYNCHRONOUS}")
+    cursor.close()
+
 # Create upload directory if it doesn't exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-os.makedirs('encodings', exist_ok=True)
+os.makedirs(app.config['ENCODINGS_FOLDER'], exist_ok=True)
 
 # Database Models
 class Student(db.Model):
@@ -44,111 +64,139 @@ class Attendance(db.Model):
     time_in = db.Column(db.DateTime)
     time_out = db.Column(db.DateTime)
     status = db.Column(db.String(20), default='Present')
+    
+    __table_args__ = (
+        db.Index('ix_attendance_student_date', 'student_id', 'date', unique=True),
+    )
 
 # Global variables
-known_face_encodings = []
-known_face_names = []
-camera = None
+# Known faces are swapped as one (names, encodings, squared norms) tuple so the
+# live feed never sees names and rows from different generations.
+known_faces = ([], np.zeros((0, ENCODING_DIM)), np.zeros((0,)))
+encoding_store = EncodingStore(app.config['ENCODINGS_FOLDER'])
+attendance_recorder = AttendanceRecorder(
+    app, db, Attendance,
+    min_gap=Config.ATTENDANCE_MIN_GAP,
+    flush_interval=Config.ATTENDANCE_FLUSH_INTERVAL,
+)
+
+def set_known_faces(names, encodings):
+    """Install a new set of known faces as one contiguous (N, 128) matrix"""
+    global known_faces
+    
+    encodings = np.ascontiguousarray(encodings, dtype=np.float64).reshape(-1, ENCODING_DIM)
+    known_faces = (list(names), encodings, np.einsum('ij,ij->i', encodings, encodings))
+
+def encode_face_image(image_path):
+    """Compute the face encoding of the first face found in an image file"""
+    image = face_recognition.load_image_file(image_path)
+    encodings = face_recognition.face_encodings(image)
+    return encodings[0] if encodings else None
 
 def load_known_faces():
-    """Load all known face encodings from the database"""
-    global known_face_encodings, known_face_names
+    """Load all known face encodings, re-encoding only new or changed photos"""
+    students = Student.query.with_entities(Student.student_id, Student.image_path).all()
+    names, encodings = encoding_store.sync(students, encode_face_image)
+    set_known_faces(names, encodings)
+
+def add_known_face(student_id, image_path, encoding):
+    """Persist and register the encoding of a newly added student"""
+    encoding_store.put(student_id, hash_file(image_path), encoding)
+    names, encodings, _ = known_faces
+    set_known_faces(names + [student_id], np.vstack([encodings, np.asarray(encoding).reshape(1, -1)]))
+
+def remove_known_face(student_id):
+    """Drop a deleted student's encoding"""
+    encoding_store.remove(student_id)
+    names, encodings, _ = known_faces
+    keep = [i for i, name in enumerate(names) if name != student_id]
+    set_known_faces([names[i] for i in keep], encodings[keep])
+
+def match_faces(face_encodings, tolerance=Config.FACE_RECOGNITION_TOLERANCE):
+    """Match a batch of face encodings against all known faces at once.
     
-    known_face_encodings = []
-    known_face_names = []
+    Returns a (student_id, distance) pair for each encoding; student_id is None
+    when the nearest known face is farther than ``tolerance``.
+    """
+    names, encodings, sq_norms = known_faces
+    if len(face_encodings) == 0 or not names:
+        return [(None, None)] * len(face_encodings)
     
-    students = Student.query.all()
-    for student in students:
-        if student.image_path and os.path.exists(student.image_path):
-            try:
-                image = face_recognition.load_image_file(student.image_path)
-                encodings = face_recognition.face_encodings(image)
-                if encodings:
-                    known_face_encodings.append(encodings[0])
-                    known_face_names.append(student.student_id)
-            except Exception as e:
-                print(f"Error loading face for {student.name}: {e}")
+    probes = np.asarray(face_encodings, dtype=np.float64).reshape(-1, ENCODING_DIM)
+    # ||a - b||^2 = ||a||^2 + ||b||^2 - 2 a.b, evaluated for every (probe, known) pair
+    sq_dists = sq_norms[np.newaxis, :] + np.einsum('ij,ij->i', probes, probes)[:, np.newaxis] - 2.0 * probes @ encodings.T
+    best = np.argmin(sq_dists, axis=1)
+    best_dists = np.sqrt(np.maximum(sq_dists[np.arange(len(best)), best], 0.0))
+    return [(names[i] if d <= tolerance else None, float(d)) for i, d in zip(best, best_dists)]
 
 def mark_attendance(student_id):
-    """Mark attendance for a student"""
-    today = date.today()
-    
-    # Check if already marked today
-    existing_attendance = Attendance.query.filter_by(
-        student_id=student_id, 
-        date=today
-    ).first()
-    
-    if existing_attendance:
-        if not existing_attendance.time_out:
-            # Mark time out
-            existing_attendance.time_out = datetime.now()
-            db.session.commit()
-            return f"Time out marked for {student_id}"
-        else:
-            return f"Attendance already complete for {student_id}"
-    else:
-        # Mark time in
-        new_attendance = Attendance(
-            student_id=student_id,
-            date=today,
-            time_in=datetime.now()
-        )
-        db.session.add(new_attendance)
-        db.session.commit()
-        return f"Time in marked for {student_id}"
+    """Mark attendance for a student (written to the database in the background)"""
+    return attendance_recorder.record(student_id)
 
-def generate_frames():
-    """Generate video frames for live feed"""
-    global camera
+def recognize_frame(frame, seq=None):
+    """Detect and track faces in a BGR frame, encoding only unconfirmed or stale tracks.
     
-    if camera is None:
-        camera = cv2.VideoCapture(0)
+    Attendance is marked whenever a face is (re-)identified. Returns a list of
+    (name, (top, right, bottom, left)) in full-frame coordinates, or None when
+    a newer frame (by ``seq``) already reached the tracker.
+    """
+    # Resize frame for faster processing
+    small_frame = cv2.resize(frame, (0, 0), fx=0.25, fy=0.25)
+    rgb_small_frame = np.ascontiguousarray(small_frame[:, :, ::-1])
     
-    while True:
-        success, frame = camera.read()
-        if not success:
-            break
-        
-        # Resize frame for faster processing
-        small_frame = cv2.resize(frame, (0, 0), fx=0.25, fy=0.25)
-        rgb_small_frame = small_frame[:, :, ::-1]
-        
-        # Find faces and encodings
-        face_locations = face_recognition.face_locations(rgb_small_frame)
-        face_encodings = face_recognition.face_encodings(rgb_small_frame, face_locations)
-        
-        for face_encoding, face_location in zip(face_encodings, face_locations):
-            # Check if face matches known faces
-            matches = face_recognition.compare_faces(known_face_encodings, face_encoding)
-            name = "Unknown"
+    # Find faces and follow them from the previous frames
+    face_locations = face_recognition.face_locations(rgb_small_frame)
+    tracks, to_encode = face_tracker.update(face_locations, seq=seq)
+    if tracks is None:
+        # Finished after a newer frame; applying it would move tracks backwards
+        return None
+    
+    if to_encode:
+        # Encode only the faces the tracker cannot vouch for, then match them in one pass
+        face_encodings = face_recognition.face_encodings(rgb_small_frame, [face_locations[i] for i in to_encode])
+        for i, (student_id, distance) in zip(to_encode, match_faces(face_encodings)):
+            face_tracker.set_identity(tracks[i], student_id, distance)
             
-            if True in matches:
-                first_match_index = matches.index(True)
-                name = known_face_names[first_match_index]
-                
+            if student_id is not None:
                 # Mark attendance
-                result = mark_attendance(name)
+                result = mark_attendance(student_id)
                 print(result)
-            
-            # Scale back up face locations
-            top, right, bottom, left = face_location
-            top *= 4
-            right *= 4
-            bottom *= 4
-            left *= 4
-            
-            # Draw rectangle and label
-            cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
-            cv2.rectangle(frame, (left, bottom - 35), (right, bottom), (0, 255, 0), cv2.FILLED)
-            cv2.putText(frame, name, (left + 6, bottom - 6), cv2.FONT_HERSHEY_DUPLEX, 0.8, (255, 255, 255), 1)
-        
-        # Encode frame to bytes
-        ret, buffer = cv2.imencode('.jpg', frame)
-        frame = buffer.tobytes()
-        
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+    
+    detections = []
+    for track, face_location in zip(tracks, face_locations):
+        # Scale back up face locations
+        top, right, bottom, left = (v * 4 for v in face_location)
+        detections.append((track.name, (top, right, bottom, left)))
+    
+    return detections
+
+def annotate_frame(frame, detections):
+    """Draw a labelled box for every detection"""
+    for name, (top, right, bottom, left) in detections:
+        cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
+        cv2.rectangle(frame, (left, bottom - 35), (right, bottom), (0, 255, 0), cv2.FILLED)
+        cv2.putText(frame, name, (left + 6, bottom - 6), cv2.FONT_HERSHEY_DUPLEX, 0.8, (255, 255, 255), 1)
+
+face_tracker = FaceTracker(
+    iou_threshold=Config.TRACKER_IOU_THRESHOLD,
+    max_misses=Config.TRACKER_MAX_MISSES,
+    reverify_seconds=Config.TRACKER_REVERIFY_SECONDS,
+    confirm_tolerance=Config.TRACKER_CONFIRM_TOLERANCE,
+)
+
+video_pipeline = VideoPipeline(
+    recognize=recognize_frame,
+    annotate=annotate_frame,
+    camera_index=Config.CAMERA_INDEX,
+    frame_rate=Config.FRAME_RATE,
+    workers=Config.VIDEO_PROCESSING_THREADS,
+    frame_width=Config.FRAME_WIDTH,
+    frame_height=Config.FRAME_HEIGHT,
+)
+
+def generate_frames():
+    """Generate video frames for live feed"""
+    return video_pipeline.frames()
 
 # Routes
 @app.route('/')
@@ -217,8 +265,8 @@ def add_student():
             db.session.add(new_student)
             db.session.commit()
             
-            # Reload known faces
-            load_known_faces()
+            # Register the new encoding without reloading every face
+            add_known_face(student_id, file_path, face_encodings[0])
             
             flash('Student added successfully!', 'success')
             return redirect(url_for('students'))
@@ -259,6 +307,13 @@ def video_feed():
     return Response(generate_frames(),
                     mimetype='multipart/x-mixed-replace; boundary=frame')
 
+@app.route('/pipeline_stats')
+def pipeline_stats():
+    stats = video_pipeline.stats()
+    stats['tracker'] = face_tracker.stats()
+    stats['attendance'] = attendance_recorder.stats()
+    return jsonify(stats)
+
 @app.route('/export_attendance')
 def export_attendance():
     selected_date = request.args.get('date', date.today().strftime('%Y-%m-%d'))
@@ -298,14 +353,15 @@ def delete_student(student_id):
             os.remove(student.image_path)
         
         # Delete attendance records
+        attendance_recorder.forget(student_id)
         Attendance.query.filter_by(student_id=student_id).delete()
         
         # Delete student
         db.session.delete(student)
         db.session.commit()
         
-        # Reload known faces
-        load_known_faces()
+        # Drop the student's encoding without reloading every face
+        remove_known_face(student_id)
         
         flash('Student deleted successfully!', 'success')
     else:
@@ -313,8 +369,19 @@ def delete_student(student_id):
     
     return redirect(url_for('students'))
 
+def ensure_indexes():
+    """Create indexes added after the tables were first created"""
+    for index in Attendance.__table__.indexes:
+        try:
+            index.create(db.engine, checkfirst=True)
+        except Exception as e:
+            print(f"Could not create index {index.name}: {e}")
+
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
+        ensure_indexes()
         load_known_faces()
+    attendance_recorder.warm()
+    attendance_recorder.start()
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -1,5 +1,6 @@
 from fastapi import FastAPI, Request, UploadFile, File, Form, HTTPException
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
@@ -9,6 +10,7 @@ from .services.db import init_db, get_session
 from .services.models import PersonRole
 from .services.face_service import FaceService
 from .services.attendance_service import AttendanceService
+from .services.inference import InferencePool, PoolSaturated
 
 app = FastAPI(title="School Face Attendance")
 
@@ -28,6 +30,24 @@ templates = Jinja2Templates(directory=TEMPLATES_DIR)
 init_db()
 face_service = FaceService(data_dir=DATA_DIR)
 attendance_service = AttendanceService()
+inference_pool = InferencePool(initializer=face_service.warm_worker)
+
+@app.on_event("startup")
+def on_startup() -> None:
+    face_service.reconcile_model()
+    attendance_service.warm()
+    attendance_service.writer.start()
+    inference_pool.start()
+
+@app.on_event("shutdown")
+def on_shutdown() -> None:
+    inference_pool.shutdown()
+    face_service.shutdown()
+    attendance_service.writer.stop()
+
+@app.exception_handler(PoolSaturated)
+async def pool_saturated_handler(request: Request, exc: PoolSaturated):
+    return JSONResponse(status_code=503, content={"ok": False, "error": str(exc)}, headers={"Retry-After": "1"})
 
 class RegisterPersonRequest(BaseModel):
     name: str
@@ -45,42 +65,84 @@ async def admin(request: Request):
 async def register_person(name: str = Form(...), role: PersonRole = Form(...), image: UploadFile = File(...)):
     try:
         image_bytes = await image.read()
-        person_id = face_service.register_person(name=name, role=role, image_bytes=image_bytes)
+        person_id = await inference_pool.run(face_service.register_person, name, role, image_bytes)
         return {"ok": True, "person_id": person_id}
+    except PoolSaturated:
+        raise
     except Exception as e:
         return {"ok": False, "error": str(e)}
 
+def _record_presence(person) -> None:
+    # Auto record student presence (deduped). For teachers, use IN/OUT buttons.
+    if person.role == PersonRole.STUDENT:
+        attendance_service.student_presence(student_id=person.id, person=person)
+
 @app.post("/api/recognize")
 async def recognize(image: UploadFile = File(...)):
     image_bytes = await image.read()
-    result = face_service.recognize(image_bytes=image_bytes)
-    if result is None:
-        return {"ok": True, "recognized": False}
-    person, confidence, liveness_ok = result
-    if not liveness_ok:
-        return {"ok": True, "recognized": False, "reason": "liveness_failed"}
-    # Auto record student presence (deduped). For teachers, use IN/OUT buttons.
-    if person.role == PersonRole.STUDENT:
-        attendance_service.student_presence(student_id=person.id)
+    result = await inference_pool.run(face_service.recognize, image_bytes, _record_presence)
+    if result.rejected is not None:
+        return {"ok": True, "recognized": False, "reason": result.rejected, "timings": result.timings}
+    person = result.person
     return {
         "ok": True,
         "recognized": True,
         "person_id": person.id,
         "name": person.name,
         "role": person.role.value,
-        "confidence": confidence,
+        "confidence": result.confidence,
+        "timings": result.timings,
     }
 
+@app.post("/api/roll-call")
+async def roll_call(image: UploadFile = File(...)):
+    # Group photo: every detected face is matched and all recognised students are
+    # marked present together. Teachers are reported but not recorded.
+    image_bytes = await image.read()
+    faces = await inference_pool.run(face_service.roll_call, image_bytes)
+    matched = [face["person_id"] for face in faces if face["reason"] is None]
+    result = await run_in_threadpool(attendance_service.roll_call, matched)
+    persons = result["persons"]
+    for face in faces:
+        person = persons.get(face["person_id"])
+        face["recognized"] = face["reason"] is None and person is not None
+        if person is not None:
+            face.update(person)
+    return {
+        "ok": True,
+        "faces": faces,
+        "present": result["present"],
+        "recorded": result["recorded"],
+        "absent": result["absent"],
+    }
+
+@app.post("/api/admin/compact")
+async def compact_model():
+    started = face_service.start_compaction()
+    return {"ok": True, "started": started}
+
 @app.post("/api/teacher/in")
-async def teacher_in(teacher_id: int = Form(...)):
+def teacher_in(teacher_id: int = Form(...)):
     attendance_service.teacher_check_in(teacher_id=teacher_id)
     return {"ok": True}
 
 @app.post("/api/teacher/out")
-async def teacher_out(teacher_id: int = Form(...)):
+def teacher_out(teacher_id: int = Form(...)):
     attendance_service.teacher_check_out(teacher_id=teacher_id)
     return {"ok": True}
 
 @app.get("/api/attendance")
-async def get_attendance():
-    return attendance_service.list_attendance()
\ No newline at end of file
+def get_attendance():
+    return attendance_service.list_attendance()
+
+@app.get("/api/inference/stats")
+async def inference_stats():
+    return inference_pool.stats()
+
+@app.get("/api/attendance/stats")
+def attendance_stats():
+    return attendance_service.stats()
+
+@app.get("/api/recognize/stats")
+async def recognize_stats():
+    return face_service.recognition_stats()
\ No newline at end of file
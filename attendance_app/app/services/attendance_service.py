@@ -1,12 +1,78 @@
+import threading
 from datetime import datetime, timedelta
-from typing import List, Dict, Any
-from .db import get_session
+from typing import List, Dict, Any, Iterable, Optional
+from sqlalchemy import func
+from .db import WriteSessionLocal, get_session
 from .models import Attendance, Person, PersonRole
+from .writer import WriteQueue
 
 DUP_WINDOW_MINUTES = 10
 
 class AttendanceService:
+    def __init__(self, window_minutes: int = DUP_WINDOW_MINUTES, writer: Optional[WriteQueue] = None):
+        self.window = timedelta(minutes=window_minutes)
+        # lookups use the pooled read sessions; inserts go through the writer thread
+        self.writer = writer or WriteQueue(WriteSessionLocal)
+        # person id -> time of the last event inside the window. Once warmed this
+        # process answers duplicate checks without SQL; it assumes it is the only
+        # writer of attendance rows.
+        self._last_event: Dict[int, datetime] = {}
+        self._lock = threading.Lock()
+        self._warm = False
+        self._pruned_at = datetime.utcnow()
+        self.suppressed = 0
+
+    def warm(self) -> None:
+        since = datetime.utcnow() - self.window
+        with get_session() as session:
+            rows = (
+                session.query(Attendance.person_id, func.max(Attendance.timestamp))
+                .filter(Attendance.timestamp >= since)
+                .group_by(Attendance.person_id)
+                .all()
+            )
+        with self._lock:
+            for person_id, timestamp in rows:
+                if timestamp > self._last_event.get(person_id, datetime.min):
+                    self._last_event[person_id] = timestamp
+            self._warm = True
+
+    def _prune(self, now: datetime) -> None:
+        # caller holds the lock; a full sweep at most once per window
+        if now - self._pruned_at < self.window:
+            return
+        cutoff = now - self.window
+        self._last_event = {pid: ts for pid, ts in self._last_event.items() if ts >= cutoff}
+        self._pruned_at = now
+
+    def _claim(self, person_ids: Iterable[int], now: datetime) -> List[int]:
+        # Marks the persons whose last event is outside the window as seen at
+        # ``now`` and returns them; everyone else is a duplicate. Claims are undone
+        # with _release if the insert fails.
+        claimed = []
+        with self._lock:
+            self._prune(now)
+            for pid in person_ids:
+                last = self._last_event.get(pid)
+                if last is not None and now - last < self.window:
+                    self.suppressed += 1
+                    continue
+                self._last_event[pid] = now
+                claimed.append(pid)
+        return claimed
+
+    def _release(self, person_ids: Iterable[int], now: datetime) -> None:
+        with self._lock:
+            for pid in person_ids:
+                if self._last_event.get(pid) == now:
+                    del self._last_event[pid]
+
+    def _note(self, person_id: int, now: datetime) -> None:
+        with self._lock:
+            self._last_event[person_id] = max(now, self._last_event.get(person_id, now))
+
     def _recent_event_exists(self, session, person_id: int, window_minutes: int = DUP_WINDOW_MINUTES) -> bool:
+        # cold path, only used before warm() has run
         since = datetime.utcnow() - timedelta(minutes=window_minutes)
         exists = (
             session.query(Attendance)
@@ -16,49 +82,102 @@ class AttendanceService:
         )
         return exists
 
+    def _insert(self, person_id: int, is_check_in: bool, person: Optional[Person], role: Optional[PersonRole]) -> None:
+        now = datetime.utcnow()
+        if self._warm and not self._claim([person_id], now):
+            return
+        try:
+            with get_session() as session:
+                if person is None:
+                    query = session.query(Person).filter(Person.id == person_id)
+                    if role is not None:
+                        query = query.filter(Person.role == role)
+                    person = query.first()
+                elif role is not None and person.role != role:
+                    person = None
+                if person is None:
+                    raise ValueError("Student not found" if role == PersonRole.STUDENT else "Person not found")
+                if not self._warm and self._recent_event_exists(session, person_id):
+                    return
+            self.writer.write([Attendance(person_id=person_id, timestamp=now, is_check_in=is_check_in)])
+        except Exception:
+            if self._warm:
+                self._release([person_id], now)
+            raise
+        if not self._warm:
+            self._note(person_id, now)
+
     def record_attendance(self, person_id: int, is_check_in: bool = True) -> None:
+        self._insert(person_id, is_check_in, None, None)
+
+    def student_presence(self, student_id: int, person: Optional[Person] = None) -> None:
+        # pass ``person`` when the caller already resolved it to skip the lookup
+        self._insert(student_id, True, person, PersonRole.STUDENT)
+
+    def roll_call(self, person_ids: List[int]) -> Dict[str, Any]:
+        # Records presence for every recognised student of a group photo in one
+        # transaction and reports the enrolled students who were not seen.
+        seen = set(person_ids)
         with get_session() as session:
-            person = session.query(Person).filter(Person.id == person_id).first()
-            if person is None:
-                raise ValueError("Person not found")
-            if self._recent_event_exists(session, person_id):
-                return
-            entry = Attendance(person_id=person_id, timestamp=datetime.utcnow(), is_check_in=is_check_in)
-            session.add(entry)
-            session.commit()
-
-    def student_presence(self, student_id: int) -> None:
-        with get_session() as session:
-            student = (
-                session.query(Person)
-                .filter(Person.id == student_id, Person.role == PersonRole.STUDENT)
-                .first()
-            )
-            if student is None:
-                raise ValueError("Student not found")
-            if self._recent_event_exists(session, student_id):
-                return
-            entry = Attendance(person_id=student_id, timestamp=datetime.utcnow(), is_check_in=True)
-            session.add(entry)
-            session.commit()
+            persons = {p.id: p for p in session.query(Person).filter(
+                (Person.role == PersonRole.STUDENT) | Person.id.in_(seen)
+            )}
+            present = [pid for pid in sorted(seen) if pid in persons and persons[pid].role == PersonRole.STUDENT]
+            now = datetime.utcnow()
+            if self._warm:
+                recorded = self._claim(present, now)
+            else:
+                since = now - self.window
+                recent = {
+                    pid
+                    for (pid,) in session.query(Attendance.person_id)
+                    .filter(Attendance.person_id.in_(present), Attendance.timestamp >= since)
+                    .distinct()
+                }
+                recorded = [pid for pid in present if pid not in recent]
+        try:
+            self.writer.write([Attendance(person_id=pid, timestamp=now, is_check_in=True) for pid in recorded])
+        except Exception:
+            if self._warm:
+                self._release(recorded, now)
+            raise
+        if not self._warm:
+            for pid in recorded:
+                self._note(pid, now)
+        return {
+            "persons": {pid: {"name": p.name, "role": p.role.value} for pid, p in persons.items() if pid in seen},
+            "present": present,
+            "recorded": recorded,
+            "absent": [
+                {"person_id": p.id, "name": p.name}
+                for p in sorted(persons.values(), key=lambda p: p.name)
+                if p.role == PersonRole.STUDENT and p.id not in seen
+            ],
+        }
 
     def teacher_check_in(self, teacher_id: int) -> None:
         with get_session() as session:
             teacher = session.query(Person).filter(Person.id == teacher_id, Person.role == PersonRole.TEACHER).first()
             if teacher is None:
                 raise ValueError("Teacher not found")
-            entry = Attendance(person_id=teacher_id, timestamp=datetime.utcnow(), is_check_in=True)
-            session.add(entry)
-            session.commit()
+        now = datetime.utcnow()
+        self.writer.write([Attendance(person_id=teacher_id, timestamp=now, is_check_in=True)])
+        self._note(teacher_id, now)
 
     def teacher_check_out(self, teacher_id: int) -> None:
         with get_session() as session:
             teacher = session.query(Person).filter(Person.id == teacher_id, Person.role == PersonRole.TEACHER).first()
             if teacher is None:
                 raise ValueError("Teacher not found")
-            entry = Attendance(person_id=teacher_id, timestamp=datetime.utcnow(), is_check_in=False)
-            session.add(entry)
-            session.commit()
+        now = datetime.utcnow()
+        self.writer.write([Attendance(person_id=teacher_id, timestamp=now, is_check_in=False)])
+        self._note(teacher_id, now)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = {"warm": self._warm, "tracked": len(self._last_event), "suppressed": self.suppressed}
+        stats["writer"] = self.writer.stats()
+        return stats
 
     def list_attendance(self) -> List[Dict[str, Any]]:
         with get_session() as session:
@@ -1,5 +1,5 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 DB_PATH = os.getenv("ATTENDANCE_DB_PATH", "sqlite:////workspace/attendance_app/data/attendance.db")
@@ -11,8 +11,32 @@ try:
 except Exception:
     pass
 
-engine = create_engine(DB_PATH, connect_args={"check_same_thread": False})
+# WAL lets kiosks read while the writer commits; NORMAL only syncs at checkpoints
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+
+def _configure_sqlite(dbapi_connection, connection_record) -> None:
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.close()
+
+
+def _create_engine(**kwargs):
+    engine = create_engine(DB_PATH, connect_args={"check_same_thread": False}, **kwargs)
+    if engine.dialect.name == "sqlite":
+        event.listen(engine, "connect", _configure_sqlite)
+    return engine
+
+
+engine = _create_engine()
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+# attendance inserts use one connection owned by the writer thread (see writer.py)
+write_engine = _create_engine(pool_size=1, max_overflow=0)
+WriteSessionLocal = sessionmaker(bind=write_engine, autoflush=False, autocommit=False)
 Base = declarative_base()
 
 
@@ -22,4 +46,8 @@ def get_session():
 
 def init_db():
     from . import models  # noqa: F401
-    Base.metadata.create_all(engine)
\ No newline at end of file
+    Base.metadata.create_all(engine)
+    # create_all skips existing tables, so add indexes introduced since
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
\ No newline at end of file
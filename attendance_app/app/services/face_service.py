@@ -1,38 +1,219 @@
 import os
 import io
+import logging
+import threading
+import time
 import cv2
 import numpy as np
-from typing import Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
 from sqlalchemy.orm import Session
 from .db import get_session
+from .lbp_index import LBPHistogramIndex
 from .models import Person, PersonRole
 from PIL import Image
 
 
+logger = logging.getLogger(__name__)
+
+# "lbph": OpenCV LBPHFaceRecognizer; "histogram": vectorized LBPHistogramIndex
+RECOGNIZER_BACKEND = os.getenv("FACE_RECOGNIZER_BACKEND", "lbph")
+
+MODEL_FILES = {
+    "lbph": "lbph_model.xml",
+    "histogram": "lbp_index.npz",
+}
+
+# Group photos: detection runs on a copy no wider than ROLL_CALL_DETECT_WIDTH and
+# faces are cropped from the full-resolution image; ROLL_CALL_MIN_FACE is in
+# original pixels. Crops are analysed on ROLL_CALL_WORKERS threads.
+ROLL_CALL_DETECT_WIDTH = int(os.getenv("ROLL_CALL_DETECT_WIDTH", "1600"))
+ROLL_CALL_MIN_FACE = int(os.getenv("ROLL_CALL_MIN_FACE", "40"))
+ROLL_CALL_WORKERS = int(os.getenv("ROLL_CALL_WORKERS", str(os.cpu_count() or 2)))
+# LBPH/chi-square distance above which a face is reported as unknown. Off by
+# default: any prediction is accepted, as before the threshold stage existed.
+# Pick a value from the distances /api/recognize reports for your own cameras.
+RECOGNITION_MAX_DISTANCE = float(os.getenv("RECOGNITION_MAX_DISTANCE", "inf"))
+# Laplacian variance below which a face crop is too blurry to judge
+MIN_SHARPNESS = float(os.getenv("MIN_SHARPNESS", "30"))
+
+# recognize() stages in order; each may stop the pipeline with a rejection
+STAGES = ("decode", "detect", "quality", "predict", "threshold", "liveness", "resolve", "record")
+REJECT_NO_FACE = "no_face"
+REJECT_LOW_QUALITY = "low_quality"
+REJECT_UNKNOWN = "unknown"
+REJECT_LIVENESS = "liveness_failed"
+
+
+@dataclass
+class Recognition:
+    person: Optional[Person] = None
+    confidence: Optional[float] = None
+    rejected: Optional[str] = None
+    # milliseconds per stage that ran
+    timings: Dict[str, float] = field(default_factory=dict)
+
+
+@contextmanager
+def _timed(timings: Dict[str, float], stage: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = round((time.perf_counter() - start) * 1000.0, 3)
+
+
 class FaceService:
-    def __init__(self, data_dir: str):
+    def __init__(self, data_dir: str, backend: str = RECOGNIZER_BACKEND):
+        if backend not in MODEL_FILES:
+            raise ValueError(f"Unknown recognizer backend: {backend}")
         self.data_dir = data_dir
-        self.model_path = os.path.join(data_dir, "lbph_model.xml")
+        self.backend = backend
+        self.model_path = os.path.join(data_dir, MODEL_FILES[backend])
         self.faces_dir = os.path.join(data_dir, "faces")
         os.makedirs(self.faces_dir, exist_ok=True)
-        self.face_detector = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
-        self.eye_detector = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_eye.xml")
-        # Use LBPH Face Recognizer
-        self.recognizer = cv2.face.LBPHFaceRecognizer_create()
-        self._maybe_load_model()
-
-    def _maybe_load_model(self) -> None:
-        if os.path.exists(self.model_path):
-            try:
-                self.recognizer.read(self.model_path)
-            except Exception:
-                pass
+        # cascade classifiers are created per worker thread (see _detectors)
+        self._local = threading.local()
+        self.recognizer = self._create_recognizer()
+        # cv2 recognizers are not thread-safe; guards update/predict/write and swaps
+        self._model_lock = threading.Lock()
+        self._save_requested = threading.Event()
+        self._saver_thread = threading.Thread(target=self._saver_loop, name="lbph-saver", daemon=True)
+        self._compaction_lock = threading.Lock()
+        self._compaction_thread: Optional[threading.Thread] = None
+        # samples registered while a compaction is rebuilding the model
+        self._pending_samples: Optional[List[Tuple[np.ndarray, int]]] = None
+        self._crop_pool: Optional[ThreadPoolExecutor] = None
+        self._crop_pool_lock = threading.Lock()
+        # id -> detached Person; entries are dropped when that id is registered
+        self._persons: Dict[int, Person] = {}
+        self._persons_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stage_ms = {stage: 0.0 for stage in STAGES}
+        self._stage_runs = {stage: 0 for stage in STAGES}
+        self._rejections: Dict[str, int] = {}
+        self.recognitions = 0
+        self._model_loaded = self._maybe_load_model()
+        self._saver_thread.start()
+
+    def _detectors(self) -> Tuple[cv2.CascadeClassifier, cv2.CascadeClassifier]:
+        detectors = getattr(self._local, "detectors", None)
+        if detectors is None:
+            detectors = (
+                cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml"),
+                cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_eye.xml"),
+            )
+            self._local.detectors = detectors
+        return detectors
+
+    @property
+    def face_detector(self) -> cv2.CascadeClassifier:
+        return self._detectors()[0]
+
+    @property
+    def eye_detector(self) -> cv2.CascadeClassifier:
+        return self._detectors()[1]
+
+    def warm_worker(self) -> None:
+        self._detectors()
+
+    def _crop_executor(self) -> ThreadPoolExecutor:
+        with self._crop_pool_lock:
+            if self._crop_pool is None:
+                self._crop_pool = ThreadPoolExecutor(
+                    max_workers=max(1, ROLL_CALL_WORKERS),
+                    thread_name_prefix="roll-call",
+                    initializer=self.warm_worker,
+                )
+            return self._crop_pool
+
+    def shutdown(self) -> None:
+        with self._crop_pool_lock:
+            if self._crop_pool is not None:
+                self._crop_pool.shutdown(wait=True)
+                self._crop_pool = None
+
+    def _create_recognizer(self):
+        if self.backend == "histogram":
+            return LBPHistogramIndex()
+        return cv2.face.LBPHFaceRecognizer_create()
+
+    def _maybe_load_model(self) -> bool:
+        # True only if a saved model for this backend was read
+        if not os.path.exists(self.model_path):
+            return False
+        try:
+            self.recognizer.read(self.model_path)
+        except Exception:
+            logger.exception("Could not read %s model from %s", self.backend, self.model_path)
+            self.recognizer = self._create_recognizer()
+            return False
+        return True
+
+    def _model_labels(self) -> Set[int]:
+        with self._model_lock:
+            if self.backend == "histogram":
+                labels = self.recognizer.labels
+            else:
+                labels = self.recognizer.getLabels()
+        return set() if labels is None else {int(label) for label in np.asarray(labels).ravel()}
+
+    def reconcile_model(self) -> None:
+        # Called once at startup. Without a readable model file for this backend
+        # (first run after switching FACE_RECOGNIZER_BACKEND, or a corrupt file)
+        # every enrolled person would be unknown, so rebuild from their images.
+        # A loaded model can also lag the database: registrations are saved by
+        # the background saver, and a crash before it ran loses them.
+        with get_session() as session:
+            enrolled = {pid for (pid,) in session.query(Person.id).filter(Person.image_path != "")}
+        if not enrolled:
+            self._model_loaded = True
+            return
+        if not self._model_loaded:
+            logger.warning("No usable %s model at %s; rebuilding from %d enrolled faces", self.backend, self.model_path, len(enrolled))
+            self.compact()
+            self._model_loaded = True
+            return
+        known = self._model_labels()
+        if known - enrolled:
+            logger.warning("%s model has %d labels not in the database; rebuilding", self.backend, len(known - enrolled))
+            self.compact()
+            return
+        missing = enrolled - known
+        if not missing:
+            return
+        # registrations the last save did not capture: add just those samples
+        logger.warning("%s model is missing %d enrolled persons; adding them", self.backend, len(missing))
+        with get_session() as session:
+            persons = session.query(Person).filter(Person.id.in_(missing)).all()
+        for person in persons:
+            img = cv2.imread(person.image_path, cv2.IMREAD_GRAYSCALE) if os.path.exists(person.image_path) else None
+            if img is not None:
+                self._add_sample(img, person.id)
+        self.request_save()
 
     def _save_model(self) -> None:
+        # Write to a temp file and rename so a crash never leaves a truncated model
+        root, ext = os.path.splitext(self.model_path)
+        tmp_path = f"{root}.tmp{ext}"
         try:
-            self.recognizer.write(self.model_path)
+            with self._model_lock:
+                self.recognizer.write(tmp_path)
+            os.replace(tmp_path, self.model_path)
         except Exception:
-            pass
+            # the in-memory model keeps serving; startup reconciles the file
+            logger.exception("Could not save %s model to %s", self.backend, self.model_path)
+
+    def _saver_loop(self) -> None:
+        while True:
+            self._save_requested.wait()
+            self._save_requested.clear()
+            self._save_model()
+
+    def request_save(self) -> None:
+        self._save_requested.set()
 
     def _read_image_bytes(self, image_bytes: bytes) -> np.ndarray:
         image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
@@ -49,17 +230,90 @@ class FaceService:
         face_resized = cv2.resize(face_roi, (200, 200))
         return face_resized
 
-    def _liveness_heuristic(self, face_gray_200: np.ndarray) -> bool:
-        # Simple liveness: image sharpness + eye detection in upper half
+    def _detect_faces(self, gray: np.ndarray) -> List[Tuple[int, int, int, int]]:
+        # every face in a (possibly large) photo, boxes in full-resolution pixels
+        height, width = gray.shape[:2]
+        scale = min(1.0, ROLL_CALL_DETECT_WIDTH / float(width)) if ROLL_CALL_DETECT_WIDTH > 0 else 1.0
+        small = gray if scale == 1.0 else cv2.resize(gray, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+        min_size = max(20, int(ROLL_CALL_MIN_FACE * scale))
+        faces = self.face_detector.detectMultiScale(small, scaleFactor=1.1, minNeighbors=5, minSize=(min_size, min_size))
+        boxes = []
+        for x, y, w, h in faces:
+            x, y = int(x / scale), int(y / scale)
+            w, h = min(int(w / scale), width - x), min(int(h / scale), height - y)
+            boxes.append((x, y, w, h))
+        # reading order: top to bottom, then left to right
+        return sorted(boxes, key=lambda b: (b[1] // max(1, b[3]), b[0]))
+
+    def _analyze_crop(self, gray: np.ndarray, box: Tuple[int, int, int, int]) -> Tuple[np.ndarray, bool, Optional[np.ndarray]]:
+        x, y, w, h = box
+        face_img = cv2.resize(gray[y : y + h, x : x + w], (200, 200))
+        live_ok = self._liveness_heuristic(face_img)
+        # histogram extraction is the expensive part of a histogram-backend query
+        features = self.recognizer.extract(face_img) if self.backend == "histogram" else None
+        return face_img, live_ok, features
+
+    def _predict_batch(self, crops: List[Tuple[np.ndarray, bool, Optional[np.ndarray]]]) -> List[Tuple[int, float]]:
+        with self._model_lock:
+            if self.backend == "histogram":
+                matches = self.recognizer.search_histograms(np.stack([f for _, _, f in crops]), k=1)
+                return [m[0] if m else (-1, float("inf")) for m in matches]
+            results = []
+            for face_img, _, _ in crops:
+                try:
+                    results.append(self.recognizer.predict(face_img))
+                except cv2.error:
+                    results.append((-1, float("inf")))
+            return results
+
+    def roll_call(self, image_bytes: bytes) -> List[Dict[str, Any]]:
+        # One entry per detected face: box, liveness and the matched label (None if
+        # unknown). A label matched by several faces is kept only for the closest.
+        bgr = self._read_image_bytes(image_bytes)
+        gray = cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY)
+        boxes = self._detect_faces(gray)
+        if not boxes:
+            return []
+        crops = list(self._crop_executor().map(lambda box: self._analyze_crop(gray, box), boxes))
+        predictions = self._predict_batch(crops)
+        faces = []
+        best: Dict[int, int] = {}
+        for i, (box, (_, live_ok, _), (label, distance)) in enumerate(zip(boxes, crops, predictions)):
+            label = int(label)
+            known = label >= 0 and distance <= RECOGNITION_MAX_DISTANCE
+            faces.append({
+                "box": list(box),
+                "live": live_ok,
+                "person_id": label if known else None,
+                "confidence": float(distance) if label >= 0 else None,
+                "reason": None if known else "unknown",
+            })
+            if known and live_ok:
+                if label in best and faces[best[label]]["confidence"] <= distance:
+                    faces[i]["person_id"], faces[i]["reason"] = None, "duplicate"
+                    continue
+                if label in best:
+                    faces[best[label]]["person_id"], faces[best[label]]["reason"] = None, "duplicate"
+                best[label] = i
+        for face in faces:
+            if face["reason"] is None and not face["live"]:
+                face["reason"] = "liveness_failed"
+        return faces
+
+    def _sharp_enough(self, face_gray_200: np.ndarray) -> bool:
         if face_gray_200 is None or face_gray_200.size == 0:
             return False
-        lap_var = cv2.Laplacian(face_gray_200, cv2.CV_64F).var()
-        if lap_var < 30.0:
-            return False
+        return cv2.Laplacian(face_gray_200, cv2.CV_64F).var() >= MIN_SHARPNESS
+
+    def _eyes_visible(self, face_gray_200: np.ndarray) -> bool:
         upper = face_gray_200[:100, :]
         eyes = self.eye_detector.detectMultiScale(upper, scaleFactor=1.2, minNeighbors=5, minSize=(15, 15))
         return len(eyes) >= 1
 
+    def _liveness_heuristic(self, face_gray_200: np.ndarray) -> bool:
+        # Simple liveness: image sharpness + eye detection in upper half
+        return self._sharp_enough(face_gray_200) and self._eyes_visible(face_gray_200)
+
     def register_person(self, name: str, role: PersonRole, image_bytes: bytes) -> int:
         bgr = self._read_image_bytes(image_bytes)
         face_img = self._detect_face(bgr)
@@ -80,11 +334,25 @@ class FaceService:
             person.image_path = face_path
             session.commit()
 
-            # retrain recognizer with all faces
-            self._retrain(session)
-            return person.id
+            person_id = person.id
+
+        # a SQLite rowid can be reused after a delete, never serve a stale entry
+        self._forget_person(person_id)
+        # add only the new sample to the recognizer; persisted in the background
+        self._add_sample(face_img, person_id)
+        self.request_save()
+        return person_id
 
-    def _retrain(self, session: Session) -> None:
+    def _add_sample(self, face_img: np.ndarray, label: int) -> None:
+        with self._model_lock:
+            try:
+                self.recognizer.update([face_img], np.array([label]))
+            except cv2.error:
+                pass
+            if self._pending_samples is not None:
+                self._pending_samples.append((face_img, label))
+
+    def _load_training_set(self, session: Session) -> Tuple[List[np.ndarray], List[int]]:
         persons = session.query(Person).all()
         images = []
         labels = []
@@ -95,23 +363,133 @@ class FaceService:
                     continue
                 images.append(img)
                 labels.append(p.id)
-        if len(images) >= 1:
-            try:
-                self.recognizer.train(images, np.array(labels))
-                self._save_model()
-            except cv2.error:
-                pass
+        return images, labels
 
-    def recognize(self, image_bytes: bytes) -> Optional[Tuple[Person, float, bool]]:
-        bgr = self._read_image_bytes(image_bytes)
-        face_img = self._detect_face(bgr)
-        if face_img is None:
-            return None
-        live_ok = self._liveness_heuristic(face_img)
+    def compact(self) -> None:
+        # Full rebuild from the enrolled face images, e.g. after persons were removed.
+        with self._model_lock:
+            self._pending_samples = []
+        swapped = False
         try:
-            label, confidence = self.recognizer.predict(face_img)
+            with get_session() as session:
+                images, labels = self._load_training_set(session)
+            recognizer = self._create_recognizer()
+            if images:
+                recognizer.train(images, np.array(labels))
+            with self._model_lock:
+                # replay registrations that arrived while the rebuild was running
+                known = set(labels)
+                replay = [(img, label) for img, label in self._pending_samples if label not in known]
+                if replay:
+                    recognizer.update([img for img, _ in replay], np.array([label for _, label in replay]))
+                self.recognizer = recognizer
+                swapped = True
         except cv2.error:
-            return None
+            # keep serving from the current model
+            return
+        finally:
+            # registrations must stop buffering however the rebuild ended
+            with self._model_lock:
+                self._pending_samples = None
+        if swapped:
+            self.request_save()
+
+    def start_compaction(self) -> bool:
+        with self._compaction_lock:
+            if self._compaction_thread is not None and self._compaction_thread.is_alive():
+                return False
+            self._compaction_thread = threading.Thread(target=self.compact, name="lbph-compaction", daemon=True)
+            self._compaction_thread.start()
+            return True
+
+    def _forget_person(self, person_id: int) -> None:
+        with self._persons_lock:
+            self._persons.pop(person_id, None)
+
+    def _resolve_person(self, person_id: int) -> Optional[Person]:
+        with self._persons_lock:
+            person = self._persons.get(person_id)
+        if person is not None:
+            return person
         with get_session() as session:
-            person = session.query(Person).filter(Person.id == label).first()
-        return (person, float(confidence), live_ok) if person else None
\ No newline at end of file
+            person = session.query(Person).filter(Person.id == person_id).first()
+        if person is not None:
+            with self._persons_lock:
+                self._persons[person_id] = person
+        return person
+
+    def _predict(self, face_img: np.ndarray) -> Optional[Tuple[int, float]]:
+        try:
+            with self._model_lock:
+                label, confidence = self.recognizer.predict(face_img)
+        except cv2.error:
+            return None
+        return int(label), float(confidence)
+
+    def recognize(self, image_bytes: bytes, record: Optional[Callable[[Person], None]] = None) -> Recognition:
+        # Runs the stages in order and stops at the first rejection, so blurry or
+        # unknown faces never pay for the eye cascade or a person lookup. ``record``
+        # is the final stage, called with the resolved person.
+        result = Recognition()
+        timings = result.timings
+        try:
+            with _timed(timings, "decode"):
+                bgr = self._read_image_bytes(image_bytes)
+            with _timed(timings, "detect"):
+                face_img = self._detect_face(bgr)
+            if face_img is None:
+                result.rejected = REJECT_NO_FACE
+                return result
+            with _timed(timings, "quality"):
+                sharp = self._sharp_enough(face_img)
+            if not sharp:
+                result.rejected = REJECT_LOW_QUALITY
+                return result
+            with _timed(timings, "predict"):
+                prediction = self._predict(face_img)
+            with _timed(timings, "threshold"):
+                known = prediction is not None and prediction[0] >= 0 and prediction[1] <= RECOGNITION_MAX_DISTANCE
+            if prediction is not None and prediction[0] >= 0:
+                result.confidence = prediction[1]
+            if not known:
+                result.rejected = REJECT_UNKNOWN
+                return result
+            with _timed(timings, "liveness"):
+                live_ok = self._eyes_visible(face_img)
+            if not live_ok:
+                result.rejected = REJECT_LIVENESS
+                return result
+            with _timed(timings, "resolve"):
+                result.person = self._resolve_person(prediction[0])
+            if result.person is None:
+                result.rejected = REJECT_UNKNOWN
+                return result
+            if record is not None:
+                with _timed(timings, "record"):
+                    record(result.person)
+            return result
+        finally:
+            self._observe(result)
+
+    def _observe(self, result: Recognition) -> None:
+        with self._stats_lock:
+            self.recognitions += 1
+            for stage, ms in result.timings.items():
+                self._stage_ms[stage] += ms
+                self._stage_runs[stage] += 1
+            if result.rejected is not None:
+                self._rejections[result.rejected] = self._rejections.get(result.rejected, 0) + 1
+
+    def recognition_stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {
+                "recognitions": self.recognitions,
+                "rejections": dict(self._rejections),
+                "stages": {
+                    stage: {
+                        "runs": self._stage_runs[stage],
+                        "avg_ms": round(self._stage_ms[stage] / self._stage_runs[stage], 3) if self._stage_runs[stage] else 0.0,
+                    }
+                    for stage in STAGES
+                },
+            }
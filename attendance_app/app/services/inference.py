@@ -0,0 +1,81 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+# Kept in step with face_attendance/app/inference.py. Each app runs
+# from its own directory as a top-level ``app`` package with its own
+# requirements and image, so the pool is copied rather than shared.
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "2"))
+INFERENCE_MAX_QUEUE = int(os.getenv("INFERENCE_MAX_QUEUE", "8"))
+
+
+class PoolSaturated(Exception):
+    pass
+
+
+class InferencePool:
+    # Bounded worker pool for blocking OpenCV/DB work called from async handlers.
+    # At most ``workers`` jobs run at once and ``max_queue`` more may wait; beyond
+    # that ``run`` raises PoolSaturated so the API can answer 503 immediately.
+    def __init__(
+        self,
+        workers: int = INFERENCE_WORKERS,
+        max_queue: int = INFERENCE_MAX_QUEUE,
+        initializer: Optional[Callable[[], None]] = None,
+    ):
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self._initializer = initializer
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._inflight = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def start(self) -> None:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix="inference",
+                initializer=self._initializer,
+            )
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def _acquire(self) -> None:
+        with self._lock:
+            if self._inflight >= self.workers + self.max_queue:
+                self.rejected += 1
+                raise PoolSaturated("Inference workers are busy, retry shortly")
+            self._inflight += 1
+
+    def _release(self) -> None:
+        with self._lock:
+            self._inflight -= 1
+            self.completed += 1
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        self.start()
+        self._acquire()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, fn, *args)
+        finally:
+            self._release()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            inflight = self._inflight
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "running": min(inflight, self.workers),
+            "queued": max(0, inflight - self.workers),
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
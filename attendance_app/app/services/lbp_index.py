@@ -0,0 +1,180 @@
+import io
+import os
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+# Matches cv2.face.LBPHFaceRecognizer_create() defaults
+DEFAULT_RADIUS = 1
+DEFAULT_NEIGHBORS = 8
+DEFAULT_GRID = 8
+
+
+def _lbp_codes(gray: np.ndarray, radius: int, neighbors: int) -> np.ndarray:
+    # Circular LBP with bilinear interpolation, same sampling as OpenCV's elbp
+    src = np.asarray(gray, dtype=np.float32)
+    rows, cols = src.shape
+    center = src[radius : rows - radius, radius : cols - radius]
+    codes = np.zeros(center.shape, dtype=np.int64)
+    for n in range(neighbors):
+        x = radius * np.cos(2.0 * np.pi * n / neighbors)
+        y = -radius * np.sin(2.0 * np.pi * n / neighbors)
+        fx, fy = int(np.floor(x)), int(np.floor(y))
+        cx, cy = int(np.ceil(x)), int(np.ceil(y))
+        tx, ty = x - fx, y - fy
+        w1 = (1 - tx) * (1 - ty)
+        w2 = tx * (1 - ty)
+        w3 = (1 - tx) * ty
+        w4 = tx * ty
+
+        def shifted(dy: int, dx: int) -> np.ndarray:
+            return src[radius + dy : rows - radius + dy, radius + dx : cols - radius + dx]
+
+        t = (
+            np.float32(w1) * shifted(fy, fx)
+            + np.float32(w2) * shifted(fy, cx)
+            + np.float32(w3) * shifted(cy, fx)
+            + np.float32(w4) * shifted(cy, cx)
+        )
+        bit = (t > center) | (np.abs(t - center) < np.finfo(np.float32).eps)
+        codes += bit.astype(np.int64) << n
+    return codes
+
+
+def lbp_histogram(
+    gray: np.ndarray,
+    radius: int = DEFAULT_RADIUS,
+    neighbors: int = DEFAULT_NEIGHBORS,
+    grid_x: int = DEFAULT_GRID,
+    grid_y: int = DEFAULT_GRID,
+) -> np.ndarray:
+    codes = _lbp_codes(gray, radius, neighbors)
+    bins = 1 << neighbors
+    height = codes.shape[0] // grid_y
+    width = codes.shape[1] // grid_x
+    cells = codes[: height * grid_y, : width * grid_x]
+    cells = cells.reshape(grid_y, height, grid_x, width).transpose(0, 2, 1, 3).reshape(grid_y * grid_x, height * width)
+    # per-cell normalised histograms via one bincount over offset codes
+    offsets = (np.arange(grid_y * grid_x, dtype=np.int64) * bins)[:, None]
+    hist = np.bincount((cells + offsets).ravel(), minlength=grid_y * grid_x * bins).astype(np.float32)
+    return hist / np.float32(height * width)
+
+
+class LBPHistogramIndex:
+    # LBP spatial histograms held in one matrix. Implements the subset of the cv2
+    # LBPH recognizer API used by FaceService (train/update/predict/read/write)
+    # plus ``search`` for top-k queries over many probe faces at once.
+    METRICS = ("chi2", "intersection")
+
+    def __init__(
+        self,
+        radius: int = DEFAULT_RADIUS,
+        neighbors: int = DEFAULT_NEIGHBORS,
+        grid_x: int = DEFAULT_GRID,
+        grid_y: int = DEFAULT_GRID,
+        metric: str = "chi2",
+        chunk_rows: int = 256,
+    ):
+        if metric not in self.METRICS:
+            raise ValueError(f"Unknown metric: {metric}")
+        self.radius = radius
+        self.neighbors = neighbors
+        self.grid_x = grid_x
+        self.grid_y = grid_y
+        self.metric = metric
+        self.chunk_rows = chunk_rows
+        self.dim = grid_x * grid_y * (1 << neighbors)
+        self.histograms = np.zeros((0, self.dim), dtype=np.float32)
+        self.labels = np.zeros((0,), dtype=np.int64)
+
+    def __len__(self) -> int:
+        return int(self.labels.shape[0])
+
+    def extract(self, gray: np.ndarray) -> np.ndarray:
+        return lbp_histogram(gray, self.radius, self.neighbors, self.grid_x, self.grid_y)
+
+    def train(self, images: Sequence[np.ndarray], labels: np.ndarray) -> None:
+        self.histograms = np.zeros((0, self.dim), dtype=np.float32)
+        self.labels = np.zeros((0,), dtype=np.int64)
+        self.update(images, labels)
+
+    def update(self, images: Sequence[np.ndarray], labels: np.ndarray) -> None:
+        if len(images) == 0:
+            return
+        block = np.stack([self.extract(img) for img in images])
+        self.histograms = np.vstack([self.histograms, block])
+        self.labels = np.concatenate([self.labels, np.asarray(labels, dtype=np.int64).ravel()])
+
+    def remove(self, label: int) -> None:
+        keep = self.labels != label
+        self.histograms = self.histograms[keep]
+        self.labels = self.labels[keep]
+
+    def distances(self, probes: np.ndarray) -> np.ndarray:
+        # (Q, N) distance matrix; smaller is better for both metrics
+        probes = np.atleast_2d(np.asarray(probes, dtype=np.float32))
+        gallery = self.histograms
+        out = np.empty((probes.shape[0], gallery.shape[0]), dtype=np.float32)
+        cells = np.float32(self.grid_x * self.grid_y)
+        for start in range(0, gallery.shape[0], self.chunk_rows):
+            block = gallery[start : start + self.chunk_rows]
+            for qi, probe in enumerate(probes):
+                if self.metric == "chi2":
+                    # cv2.HISTCMP_CHISQR_ALT, the distance used by LBPHFaceRecognizer.predict
+                    diff = block - probe
+                    total = block + probe
+                    with np.errstate(divide="ignore", invalid="ignore"):
+                        terms = np.where(total > 0, diff * diff / total, 0.0)
+                    out[qi, start : start + block.shape[0]] = 2.0 * terms.sum(axis=1)
+                else:
+                    out[qi, start : start + block.shape[0]] = cells - np.minimum(block, probe).sum(axis=1)
+        return out
+
+    def search(self, images: Sequence[np.ndarray], k: int = 1) -> List[List[Tuple[int, float]]]:
+        if len(images) == 0:
+            return []
+        if len(self) == 0:
+            return [[] for _ in images]
+        return self.search_histograms(np.stack([self.extract(img) for img in images]), k)
+
+    def search_histograms(self, probes: np.ndarray, k: int = 1) -> List[List[Tuple[int, float]]]:
+        # same as search for histograms already extracted, e.g. on worker threads
+        if probes.shape[0] == 0:
+            return []
+        if len(self) == 0:
+            return [[] for _ in range(probes.shape[0])]
+        dist = self.distances(probes)
+        k = min(k, dist.shape[1])
+        results = []
+        for row in dist:
+            top = np.argpartition(row, k - 1)[:k] if k < row.shape[0] else np.arange(row.shape[0])
+            top = top[np.argsort(row[top], kind="stable")]
+            results.append([(int(self.labels[i]), float(row[i])) for i in top])
+        return results
+
+    def predict(self, image: np.ndarray) -> Tuple[int, float]:
+        matches = self.search([image], k=1)[0]
+        if not matches:
+            return -1, float("inf")
+        return matches[0]
+
+    def write(self, path: str) -> None:
+        buffer = io.BytesIO()
+        np.savez(
+            buffer,
+            histograms=self.histograms,
+            labels=self.labels,
+            params=np.array([self.radius, self.neighbors, self.grid_x, self.grid_y], dtype=np.int64),
+        )
+        with open(path, "wb") as f:
+            f.write(buffer.getvalue())
+
+    def read(self, path: str) -> None:
+        if not os.path.exists(path):
+            return
+        with np.load(path) as data:
+            radius, neighbors, grid_x, grid_y = (int(v) for v in data["params"])
+            if (radius, neighbors, grid_x, grid_y) != (self.radius, self.neighbors, self.grid_x, self.grid_y):
+                raise ValueError("Stored index was built with different LBP parameters")
+            self.histograms = np.ascontiguousarray(data["histograms"], dtype=np.float32)
+            self.labels = np.asarray(data["labels"], dtype=np.int64)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Enum, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, Enum, ForeignKey, Boolean, Index
 from sqlalchemy.orm import relationship
 from enum import Enum as PyEnum
 from datetime import datetime
@@ -20,6 +20,8 @@ class Person(Base):
 
 class Attendance(Base):
     __tablename__ = "attendance"
+    # duplicate checks filter on person_id and a timestamp range
+    __table_args__ = (Index("ix_attendance_person_timestamp", "person_id", "timestamp"),)
     id = Column(Integer, primary_key=True, index=True)
     person_id = Column(Integer, ForeignKey("persons.id"), nullable=False)
     timestamp = Column(DateTime, default=datetime.utcnow, index=True)
@@ -0,0 +1,121 @@
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "512"))
+
+
+class WriteQueue:
+    # Single writer for attendance rows. Callers queue ORM objects and block until
+    # they are committed; the writer thread drains everything queued so far into
+    # one transaction, so concurrent kiosks share a commit instead of contending
+    # for the SQLite write lock one event at a time.
+    def __init__(self, session_factory: Callable[[], Session], batch_size: int = WRITE_BATCH_SIZE):
+        self.session_factory = session_factory
+        self.batch_size = max(1, batch_size)
+        self._queue: "queue.Queue[Optional[Tuple[List[Any], Future]]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self.commits = 0
+        self.rows_written = 0
+        self.failures = 0
+
+    def start(self) -> None:
+        with self._start_lock:
+            self._ensure_started()
+
+    def _ensure_started(self) -> None:
+        # caller holds _start_lock
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="attendance-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        # The sentinel is queued and the writer joined under _start_lock, so a
+        # concurrent submit() can neither start a second writer that would eat
+        # the sentinel nor queue rows behind it; it waits and then restarts.
+        with self._start_lock:
+            thread = self._thread
+            if thread is None or not thread.is_alive():
+                self._thread = None
+                return
+            # queued writes ahead of the sentinel are still committed
+            self._queue.put(None)
+            thread.join(timeout=5.0)
+            if not thread.is_alive():
+                self._thread = None
+
+    def submit(self, rows: List[Any]) -> Future:
+        future: Future = Future()
+        if not rows:
+            future.set_result(0)
+            return future
+        with self._start_lock:
+            self._ensure_started()
+            self._queue.put((rows, future))
+        return future
+
+    def write(self, rows: List[Any]) -> int:
+        # rows of one call always land in the same transaction
+        return self.submit(rows).result()
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            size = len(item[0])
+            stopping = False
+            while size < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+                size += len(item[0])
+            self._commit(batch)
+            if stopping:
+                return
+
+    def _commit(self, batch: List[Tuple[List[Any], Future]]) -> None:
+        try:
+            self._flush([row for rows, _ in batch for row in rows])
+        except Exception as exc:
+            if len(batch) == 1:
+                self.failures += 1
+                batch[0][1].set_exception(exc)
+                return
+            # one bad request must not fail the others: retry them one by one
+            for item in batch:
+                self._commit([item])
+            return
+        self.commits += 1
+        for rows, future in batch:
+            self.rows_written += len(rows)
+            future.set_result(len(rows))
+
+    def _flush(self, rows: List[Any]) -> None:
+        with self.session_factory() as session:
+            try:
+                session.add_all(rows)
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self._queue.qsize(),
+            "commits": self.commits,
+            "rows_written": self.rows_written,
+            "rows_per_commit": round(self.rows_written / self.commits, 2) if self.commits else 0.0,
+            "failures": self.failures,
+        }
@@ -0,0 +1,90 @@
+import argparse
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from app.services.db import Base, _configure_sqlite
+from app.services.models import Attendance
+from app.services.writer import WriteQueue
+
+# default: rollback journal, synchronous=FULL, one commit per event (the old setup)
+MODES = ("default", "wal", "wal+writer")
+
+
+def _engine(path: str, wal: bool, **kwargs):
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False}, **kwargs)
+    if wal:
+        event.listen(engine, "connect", _configure_sqlite)
+    return engine
+
+
+def _run(mode: str, writers: int, total: int, directory: str):
+    path = os.path.join(directory, f"{mode}-{writers}.db")
+    engine = _engine(path, mode != "default", pool_size=writers, max_overflow=0)
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    queue = None
+    if mode == "wal+writer":
+        write_engine = _engine(path, True, pool_size=1, max_overflow=0)
+        queue = WriteQueue(sessionmaker(bind=write_engine))
+        queue.start()
+    per_writer = total // writers
+    errors = [0]
+    lock = threading.Lock()
+
+    def kiosk(worker: int) -> None:
+        for i in range(per_writer):
+            row = Attendance(person_id=worker * per_writer + i + 1, timestamp=datetime.utcnow(), is_check_in=True)
+            try:
+                if queue is not None:
+                    queue.write([row])
+                else:
+                    with Session() as session:
+                        session.add(row)
+                        session.commit()
+            except OperationalError:
+                # "database is locked" once the busy timeout ran out
+                with lock:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=kiosk, args=(w,)) for w in range(writers)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    commits = per_writer * writers - errors[0]
+    if queue is not None:
+        commits = queue.commits
+        queue.stop()
+    engine.dispose()
+    return per_writer * writers - errors[0], elapsed, commits, errors[0]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Attendance inserts/sec by journal mode and writer path")
+    parser.add_argument("--rows", type=int, default=4000, help="inserts per run, split across writers")
+    parser.add_argument("--writers", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--dir", default=None, help="directory for the scratch databases")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        for mode in args.modes:
+            for writers in args.writers:
+                rows, elapsed, commits, errors = _run(mode, writers, args.rows, directory)
+                print(
+                    f"{mode:<11} writers={writers:<3} {rows / elapsed:9.0f} inserts/s"
+                    f"  {rows / max(1, commits):6.1f} rows/commit  locked errors {errors}"
+                )
+
+
+if __name__ == "__main__":
+    main()
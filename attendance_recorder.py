@@ -0,0 +1,176 @@
+"""
+Write-behind attendance recorder for Face Recognition Attendance System
+
+Today's time-in/time-out state for every student is kept in memory so that a
+recognized face costs no database round-trip. Changes are queued and written
+by a background thread in batched transactions.
+"""
+
+import atexit
+import threading
+from datetime import date, datetime, timedelta
+
+
+class AttendanceRecorder:
+    """In-memory daily attendance state with a background batch writer"""
+
+    def __init__(self, app, db, model, min_gap=timedelta(minutes=30), flush_interval=1.0, batch_size=500):
+        self.app = app
+        self.db = db
+        self.model = model
+        self.min_gap = min_gap
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._exit_hook = False
+        self._day = None
+        self._state = {}  # student_id -> [time_in, time_out]
+        self._pending = {}  # (day, student_id) -> (time_in, time_out)
+        self.flushes = 0
+        self.rows_written = 0
+
+    def _load(self, day):
+        with self.app.app_context():
+            rows = self.model.query.filter_by(date=day).all()
+            return {row.student_id: [row.time_in, row.time_out] for row in rows}
+
+    def warm(self, day=None):
+        """Seed the in-memory state from the rows already stored for ``day``"""
+        day = day or date.today()
+        state = self._load(day)
+        with self._lock:
+            self._day = day
+            self._state = state
+
+    def _roll_over(self, day):
+        """Move the in-memory state forward to ``day``; never backwards"""
+        # Read outside the lock; only the first thread to reach the new day swaps,
+        # so sightings already recorded for it by another thread are kept
+        state = self._load(day)
+        with self._lock:
+            if self._day is None or self._day < day:
+                self._day = day
+                self._state = state
+
+    def start(self):
+        """Start the writer thread (idempotent); queued changes are flushed at exit"""
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='attendance-writer', daemon=True)
+            self._thread.start()
+            if not self._exit_hook:
+                atexit.register(self.stop)
+                self._exit_hook = True
+
+    def stop(self):
+        """Stop the writer thread after flushing everything still queued"""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5.0)
+            self._thread = None
+        self.flush()
+
+    def record(self, student_id, now=None):
+        """Apply a sighting of ``student_id`` and return a status message"""
+        # started here too, so WSGI hosts that never run __main__ still write
+        self.start()
+        now = now or datetime.now()
+        today = now.date()
+        if self._day is None or self._day < today:
+            self._roll_over(today)
+        with self._lock:
+            if today < self._day:
+                # a sighting from before midnight that lost the race to the rollover
+                return f"Sighting of {student_id} from {today} arrived after the day ended"
+            entry = self._state.get(student_id)
+            if entry is None:
+                self._state[student_id] = [now, None]
+                message = f"Time in marked for {student_id}"
+            elif entry[1] is None:
+                if entry[0] is not None and now - entry[0] < self.min_gap:
+                    return f"Time in already marked for {student_id}"
+                entry[1] = now
+                message = f"Time out marked for {student_id}"
+            else:
+                return f"Attendance already complete for {student_id}"
+            self._pending[(today, student_id)] = tuple(self._state[student_id])
+            pending = len(self._pending)
+        if pending >= self.batch_size:
+            self._wakeup.set()
+        return message
+
+    def forget(self, student_id):
+        """Drop all state for a student (e.g. after deletion)"""
+        with self._flush_lock, self._lock:
+            self._state.pop(student_id, None)
+            for key in [key for key in self._pending if key[1] == student_id]:
+                del self._pending[key]
+
+    def flush(self):
+        """Write all queued changes in a single transaction"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+            try:
+                self._write(pending)
+            except Exception as e:
+                print(f"Error writing attendance: {e}")
+                with self._lock:
+                    # Keep newer changes queued since the failed batch
+                    for key, change in pending.items():
+                        self._pending.setdefault(key, change)
+                return 0
+            self.flushes += 1
+            self.rows_written += len(pending)
+            return len(pending)
+
+    def _write(self, pending):
+        model = self.model
+        with self.app.app_context():
+            by_day = {}
+            for (day, student_id), (time_in, time_out) in pending.items():
+                by_day.setdefault(day, {})[student_id] = (time_in, time_out)
+            for day, changes in by_day.items():
+                existing = {
+                    row.student_id: row
+                    for row in model.query.filter(model.date == day, model.student_id.in_(list(changes))).all()
+                }
+                for student_id, (time_in, time_out) in changes.items():
+                    row = existing.get(student_id)
+                    if row is None:
+                        self.db.session.add(model(student_id=student_id, date=day, time_in=time_in, time_out=time_out))
+                    else:
+                        row.time_in = row.time_in or time_in
+                        row.time_out = time_out
+            try:
+                self.db.session.commit()
+            except Exception:
+                self.db.session.rollback()
+                raise
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'day': self._day.isoformat() if self._day else None,
+                'students_today': len(self._state),
+                'pending': len(self._pending),
+                'flushes': self.flushes,
+                'rows_written': self.rows_written,
+            }
@@ -14,6 +14,10 @@ class Config:
     # Database settings
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///attendance.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # SQLite: WAL lets the live feed read while the attendance writer commits
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS') or 5000)
     
     # File upload settings
     UPLOAD_FOLDER = 'static/student_images'
@@ -24,6 +28,12 @@ class Config:
     FACE_RECOGNITION_TOLERANCE = 0.6  # Lower = stricter matching
     FACE_DETECTION_MODEL = 'hog'  # 'hog' or 'cnn' (cnn is more accurate but slower)
     
+    # Face tracking settings (live feed)
+    TRACKER_IOU_THRESHOLD = 0.3  # Minimum box overlap to continue a track
+    TRACKER_MAX_MISSES = 5  # Frames a track survives without a matching face
+    TRACKER_REVERIFY_SECONDS = 2.0  # Re-encode confirmed faces this often
+    TRACKER_CONFIRM_TOLERANCE = 0.5  # Match distance needed to stop encoding every frame
+    
     # Camera settings
     CAMERA_INDEX = 0  # Default camera
     FRAME_RATE = 30
@@ -33,6 +43,8 @@ class Config:
     # Attendance settings
     ATTENDANCE_TIME_WINDOW = timedelta(hours=12)  # Time window for same-day attendance
     AUTO_TIMEOUT_HOURS = 8  # Automatically mark timeout after X hours
+    ATTENDANCE_MIN_GAP = timedelta(minutes=30)  # Minimum time between time in and time out
+    ATTENDANCE_FLUSH_INTERVAL = 1.0  # Seconds between batched attendance writes
     
     # Logging settings
     LOG_LEVEL = 'INFO'
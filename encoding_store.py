@@ -0,0 +1,189 @@
+"""
+Persistent face encoding store for Face Recognition Attendance System
+
+Encodings are kept in a single append-only binary file that is memory-mapped
+at startup, with a small JSON index mapping each student_id to its row and the
+SHA-1 of the image the row was computed from.
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+ENCODING_DIM = 128
+ENCODING_DTYPE = np.float64
+
+
+def hash_file(path):
+    """Return the SHA-1 hex digest of a file's contents"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class EncodingStore:
+    """On-disk face encodings keyed by student_id and image content hash"""
+
+    INDEX_FILE = 'index.json'
+    VECTORS_FILE = 'vectors.f64'
+    SYNC_BATCH = 256  # encodings appended per write during sync
+
+    def __init__(self, directory, dim=ENCODING_DIM):
+        self.directory = directory
+        self.dim = dim
+        self.index_path = os.path.join(directory, self.INDEX_FILE)
+        self.vectors_path = os.path.join(directory, self.VECTORS_FILE)
+        self._lock = threading.RLock()
+        self._index = {}  # student_id -> {'hash': str, 'row': int}
+        self._vectors = None
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _row_count(self):
+        if not os.path.exists(self.vectors_path):
+            return 0
+        row_bytes = self.dim * np.dtype(ENCODING_DTYPE).itemsize
+        return os.path.getsize(self.vectors_path) // row_bytes
+
+    def _open_vectors(self):
+        rows = self._row_count()
+        if rows == 0:
+            self._vectors = np.zeros((0, self.dim), dtype=ENCODING_DTYPE)
+        else:
+            self._vectors = np.memmap(self.vectors_path, dtype=ENCODING_DTYPE, mode='r', shape=(rows, self.dim))
+
+    def _load(self):
+        """Read the index and memory-map the vector file"""
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path) as f:
+                    self._index = json.load(f)
+            except (OSError, ValueError):
+                self._index = {}
+        self._open_vectors()
+        # Drop entries that point past the end of a truncated vector file
+        rows = self._vectors.shape[0]
+        self._index = {sid: e for sid, e in self._index.items() if e.get('row', rows) < rows}
+
+    def _write_index(self):
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self._index, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.index_path)
+
+    def get(self, student_id, image_hash=None):
+        """Return the stored encoding, or None if missing or computed from a different image"""
+        with self._lock:
+            entry = self._index.get(student_id)
+            if entry is None or (image_hash is not None and entry['hash'] != image_hash):
+                return None
+            return self._vectors[entry['row']]
+
+    def put(self, student_id, image_hash, encoding):
+        """Append an encoding for a student, replacing any previous entry"""
+        self.put_many([(student_id, image_hash, encoding)])
+
+    def put_many(self, entries):
+        """Append (student_id, image_hash, encoding) rows with one write, index update and remap"""
+        entries = list(entries)
+        if not entries:
+            return
+        matrix = np.stack([np.asarray(e, dtype=ENCODING_DTYPE).reshape(self.dim) for _, _, e in entries])
+        with self._lock:
+            row = self._row_count()
+            with open(self.vectors_path, 'ab') as f:
+                f.write(np.ascontiguousarray(matrix).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            for offset, (student_id, image_hash, _) in enumerate(entries):
+                self._index[student_id] = {'hash': image_hash, 'row': row + offset}
+            self._write_index()
+            self._open_vectors()
+            self._maybe_compact()
+
+    def remove(self, student_id):
+        """Forget a student's encoding"""
+        self.remove_many([student_id])
+
+    def remove_many(self, student_ids):
+        """Forget several students' encodings with a single index update"""
+        with self._lock:
+            removed = [sid for sid in student_ids if self._index.pop(sid, None) is not None]
+            if removed:
+                self._write_index()
+                self._maybe_compact()
+
+    def _maybe_compact(self):
+        """Rewrite the vector file once more than half of its rows are stale"""
+        total = self._vectors.shape[0]
+        if total < 64 or len(self._index) * 2 > total:
+            return
+        items = sorted(self._index.items(), key=lambda kv: kv[1]['row'])
+        if items:
+            matrix = np.asarray(self._vectors[[e['row'] for _, e in items]])
+        else:
+            matrix = np.zeros((0, self.dim), dtype=ENCODING_DTYPE)
+        tmp_path = self.vectors_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(np.ascontiguousarray(matrix).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        self._vectors = None
+        os.replace(tmp_path, self.vectors_path)
+        self._index = {sid: {'hash': e['hash'], 'row': i} for i, (sid, e) in enumerate(items)}
+        self._write_index()
+        self._open_vectors()
+
+    def sync(self, students, encode):
+        """Bring the store in line with the given students.
+
+        ``students`` is an iterable of (student_id, image_path) pairs and
+        ``encode`` computes an encoding from an image path (or returns None).
+        Only missing or stale entries are re-encoded; entries for students not
+        in the list are dropped. Returns (student_ids, encodings) in row order.
+        """
+        wanted = {}
+        for student_id, image_path in students:
+            if image_path and os.path.exists(image_path):
+                wanted[student_id] = image_path
+        with self._lock:
+            self.remove_many([sid for sid in self._index if sid not in wanted])
+            # New rows are appended in batches so the index is rewritten and the
+            # vector file remapped once per batch rather than once per student
+            pending = []
+            for student_id, image_path in wanted.items():
+                image_hash = hash_file(image_path)
+                if self.get(student_id, image_hash) is not None:
+                    continue
+                try:
+                    encoding = encode(image_path)
+                except Exception as e:
+                    print(f"Error encoding face for {student_id}: {e}")
+                    continue
+                if encoding is not None:
+                    pending.append((student_id, image_hash, encoding))
+                if len(pending) >= self.SYNC_BATCH:
+                    self.put_many(pending)
+                    pending = []
+            self.put_many(pending)
+            return self.snapshot()
+
+    def snapshot(self):
+        """Return (student_ids, encodings) for all live entries"""
+        with self._lock:
+            items = sorted(self._index.items(), key=lambda kv: kv[1]['row'])
+            student_ids = [sid for sid, _ in items]
+            if not items:
+                return student_ids, np.zeros((0, self.dim), dtype=ENCODING_DTYPE)
+            rows = [e['row'] for _, e in items]
+            if rows == list(range(self._vectors.shape[0])):
+                # No stale rows: hand out the memory map itself
+                return student_ids, self._vectors
+            return student_ids, np.asarray(self._vectors[rows])
@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import io
+import os
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from .quantize import dequantize
+
+# "exact" scans every row; "ivf" only scans the ANN_NPROBE closest of sqrt(N) lists
+GALLERY_INDEX = os.getenv("GALLERY_INDEX", "exact")
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "8"))
+ANN_MIN_ROWS = int(os.getenv("ANN_MIN_ROWS", "20000"))
+
+
+def _kmeans(data: np.ndarray, k: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    # Spherical k-means on L2-normalised rows; centroids are re-normalised every step
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(data.shape[0], size=k, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(data @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, data)
+        counts = np.bincount(assign, minlength=k)
+        empty = counts == 0
+        if empty.any():
+            # re-seed empty lists from random rows so every list stays usable
+            sums[empty] = data[rng.choice(data.shape[0], size=int(empty.sum()), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+    return centroids
+
+
+class IVFIndex:
+    # Inverted-file index over the gallery rows. Rows are bucketed by their nearest
+    # k-means centroid; a query scores the centroids and then only the rows of the
+    # ``nprobe`` best lists. The index stores row positions, not vectors, so it
+    # shares the gallery matrix. Instances are replaced, never mutated, so readers
+    # holding a snapshot stay consistent.
+    def __init__(
+        self,
+        centroids: np.ndarray,
+        assign: np.ndarray,
+        nprobe: int = ANN_NPROBE,
+        trained_rows: Optional[int] = None,
+    ) -> None:
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.assign = np.asarray(assign, dtype=np.int32)
+        self.nprobe = max(1, min(nprobe, self.centroids.shape[0]))
+        self.trained_rows = trained_rows if trained_rows is not None else int(self.assign.shape[0])
+        order = np.argsort(self.assign, kind="stable")
+        bounds = np.searchsorted(self.assign[order], np.arange(self.centroids.shape[0] + 1))
+        self._lists: List[np.ndarray] = [order[bounds[i] : bounds[i + 1]] for i in range(self.centroids.shape[0])]
+
+    def __len__(self) -> int:
+        return int(self.assign.shape[0])
+
+    @classmethod
+    def train(cls, matrix: np.ndarray, nlist: Optional[int] = None, nprobe: int = ANN_NPROBE, sample: int = 50000) -> "IVFIndex":
+        rows = matrix.shape[0]
+        nlist = nlist or max(1, int(np.sqrt(rows)))
+        nlist = min(nlist, rows)
+        data = matrix
+        if rows > sample:
+            data = matrix[np.random.default_rng(0).choice(rows, size=sample, replace=False)]
+        centroids = _kmeans(data, nlist)
+        return cls(centroids, cls._nearest(centroids, matrix), nprobe, rows)
+
+    @staticmethod
+    def _nearest(centroids: np.ndarray, block: np.ndarray, chunk: int = 8192) -> np.ndarray:
+        out = np.empty(block.shape[0], dtype=np.int32)
+        for start in range(0, block.shape[0], chunk):
+            out[start : start + chunk] = np.argmax(block[start : start + chunk] @ centroids.T, axis=1)
+        return out
+
+    def appended(self, block: np.ndarray) -> "IVFIndex":
+        assign = np.concatenate([self.assign, self._nearest(self.centroids, block)])
+        return IVFIndex(self.centroids, assign, self.nprobe, self.trained_rows)
+
+    def kept(self, keep: np.ndarray) -> "IVFIndex":
+        return IVFIndex(self.centroids, self.assign[keep], self.nprobe, self.trained_rows)
+
+    def needs_retrain(self) -> bool:
+        # list sizes drift as the gallery grows past what the centroids were fit on
+        return len(self) > 4 * max(1, self.trained_rows)
+
+    def candidates(self, probes: np.ndarray) -> List[np.ndarray]:
+        coarse = probes @ self.centroids.T
+        if self.nprobe < coarse.shape[1]:
+            top = np.argpartition(-coarse, self.nprobe - 1, axis=1)[:, : self.nprobe]
+        else:
+            top = np.broadcast_to(np.arange(coarse.shape[1]), coarse.shape)
+        return [np.concatenate([self._lists[i] for i in row]) for row in top]
+
+    def search(
+        self, matrix: np.ndarray, probes: np.ndarray, scales: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        # best row and score per probe; row -1 when the probed lists are empty.
+        # ``matrix`` may be a quantized gallery, candidates are widened to float32.
+        best_rows = np.full(probes.shape[0], -1, dtype=np.int64)
+        best_scores = np.full(probes.shape[0], -np.inf, dtype=np.float32)
+        for qi, rows in enumerate(self.candidates(probes)):
+            if rows.size == 0:
+                continue
+            scores = dequantize(matrix[rows], scales[rows] if scales is not None else None) @ probes[qi]
+            idx = int(np.argmax(scores))
+            best_rows[qi] = int(rows[idx])
+            best_scores[qi] = scores[idx]
+        return best_rows, best_scores
+
+    def save(self, path: str, student_ids: np.ndarray) -> None:
+        buffer = io.BytesIO()
+        np.savez(
+            buffer,
+            centroids=self.centroids,
+            assign=self.assign,
+            student_ids=student_ids,
+            trained_rows=np.array([self.trained_rows], dtype=np.int64),
+        )
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(buffer.getvalue())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, matrix: np.ndarray, student_ids: np.ndarray, nprobe: int = ANN_NPROBE) -> Optional["IVFIndex"]:
+        # Reuses the stored centroids; assignments are reused only if the gallery rows
+        # are unchanged, otherwise every row is re-bucketed (no k-means needed).
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                centroids = data["centroids"]
+                assign = data["assign"]
+                stored_ids = data["student_ids"]
+                trained_rows = int(data["trained_rows"][0])
+        except Exception:
+            return None
+        if centroids.ndim != 2 or centroids.shape[1] != matrix.shape[1]:
+            return None
+        if not np.array_equal(stored_ids, student_ids):
+            assign = cls._nearest(centroids, matrix)
+        return cls(centroids, assign, nprobe, trained_rows)
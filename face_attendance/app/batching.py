@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import asyncio
+import bisect
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from .inference import InferencePool, PoolSaturated
+
+BATCH_WINDOW_MS = float(os.getenv("BATCH_WINDOW_MS", "5"))
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "16"))
+
+
+class Histogram:
+    def __init__(self, bounds: Sequence[float]) -> None:
+        self.bounds = list(bounds)
+        self._counts = [0] * (len(self.bounds) + 1)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self._counts[bisect.bisect_left(self.bounds, value)] += 1
+            self.count += 1
+            self.total += value
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            buckets = {f"le_{b:g}": c for b, c in zip(self.bounds, self._counts)}
+            buckets["le_inf"] = self._counts[-1]
+            return {"count": self.count, "sum": self.total, "buckets": buckets}
+
+
+class MicroBatcher:
+    # Coalesces requests arriving within ``window_ms`` (up to ``max_batch``) into one
+    # call of ``process_batch`` on the inference pool, then fans results back out.
+    # At most ``max_pending`` requests wait to be batched (by default as many as
+    # fill the pool's queue); beyond that ``submit`` raises PoolSaturated too.
+    def __init__(
+        self,
+        pool: InferencePool,
+        process_batch: Callable[[List[Any]], List[Any]],
+        window_ms: float = BATCH_WINDOW_MS,
+        max_batch: int = BATCH_MAX_SIZE,
+        max_pending: Optional[int] = None,
+    ) -> None:
+        self.pool = pool
+        self.process_batch = process_batch
+        self.window = max(0.0, window_ms) / 1000.0
+        self.max_batch = max(1, max_batch)
+        self.max_pending = max(1, max_pending if max_pending is not None else max(1, pool.max_queue) * self.max_batch)
+        self.rejected = 0
+        self._queue: Optional[asyncio.Queue[Tuple[Any, asyncio.Future, float]]] = None
+        self._collector: Optional[asyncio.Task] = None
+        self._inflight: Set[asyncio.Task] = set()
+        self.batch_sizes = Histogram([1, 2, 4, 8, 16, 32, 64])
+        self.queue_delay_ms = Histogram([1, 2, 5, 10, 20, 50, 100, 250, 1000])
+
+    def _ensure_started(self) -> asyncio.Queue:
+        if self._queue is None or self._collector is None or self._collector.done():
+            self._queue = asyncio.Queue(maxsize=self.max_pending)
+            self._collector = asyncio.get_running_loop().create_task(self._collect(self._queue))
+        return self._queue
+
+    async def submit(self, item: Any) -> Any:
+        queue = self._ensure_started()
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        try:
+            queue.put_nowait((item, future, time.perf_counter()))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise PoolSaturated("Too many frames waiting for inference, retry shortly") from None
+        return await future
+
+    async def _collect(self, queue: asyncio.Queue) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            task = loop.create_task(self._dispatch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _dispatch(self, batch: List[Tuple[Any, asyncio.Future, float]]) -> None:
+        self.batch_sizes.observe(len(batch))
+        enqueued = [t for _, _, t in batch]
+
+        def run(items: List[Any]) -> List[Any]:
+            # queueing delay = coalescing window + wait for a free worker
+            started = time.perf_counter()
+            for t in enqueued:
+                self.queue_delay_ms.observe((started - t) * 1000.0)
+            return self.process_batch(items)
+
+        try:
+            results = await self.pool.run(run, [item for item, _, _ in batch])
+        except Exception as exc:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        for (_, future, _), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def shutdown(self) -> None:
+        if self._collector is not None:
+            self._collector.cancel()
+            self._collector = None
+        for task in list(self._inflight):
+            await asyncio.gather(task, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "window_ms": self.window * 1000.0,
+            "max_batch": self.max_batch,
+            "max_pending": self.max_pending,
+            "pending": self._queue.qsize() if self._queue is not None else 0,
+            "rejected": self.rejected,
+            "batch_size": self.batch_sizes.snapshot(),
+            "queue_delay_ms": self.queue_delay_ms.snapshot(),
+        }
@@ -1,11 +1,17 @@
 from __future__ import annotations
 
+import os
 from pathlib import Path
-from typing import Iterator
+from typing import Any, Iterator
 
-from sqlalchemy import create_engine
+from sqlalchemy import Engine, create_engine, event
 from sqlalchemy.orm import sessionmaker, DeclarativeBase, Session
 
+# WAL lets readers run while the roster writer commits; NORMAL only syncs at checkpoints
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
 
 class Base(DeclarativeBase):
     pass
@@ -16,8 +22,26 @@ def get_database_url() -> str:
     return f"sqlite:///{db_path}"
 
 
-engine = create_engine(get_database_url(), connect_args={"check_same_thread": False})
+def _configure_sqlite(dbapi_connection: Any, connection_record: Any) -> None:
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.close()
+
+
+def _create_engine(**kwargs: Any) -> Engine:
+    engine = create_engine(get_database_url(), connect_args={"check_same_thread": False}, **kwargs)
+    if engine.dialect.name == "sqlite":
+        event.listen(engine, "connect", _configure_sqlite)
+    return engine
+
+
+engine = _create_engine()
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, expire_on_commit=False, class_=Session)
+# attendance records are written only by the roster thread, on its own connection
+write_engine = _create_engine(pool_size=1, max_overflow=0)
+WriteSessionLocal = sessionmaker(bind=write_engine, autoflush=False, autocommit=False, expire_on_commit=False, class_=Session)
 
 
 def get_db() -> Iterator[Session]:
@@ -2,13 +2,17 @@ from __future__ import annotations
 
 import base64
 import io
+import os
 import threading
 import time
-from dataclasses import dataclass, field
-from typing import Dict, List, Optional, Tuple
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 
 import numpy as np
 
+from .liveness import ClientStateCache
+
 try:
     import cv2
 except Exception:  # pragma: no cover - allows partial feature use without OpenCV
@@ -16,8 +20,10 @@ except Exception:  # pragma: no cover - allows partial feature use without OpenC
 
 try:
     from insightface.app import FaceAnalysis
+    from insightface.utils import face_align
 except Exception:
     FaceAnalysis = None  # type: ignore
+    face_align = None  # type: ignore
 
 try:
     import mediapipe as mp
@@ -25,44 +31,108 @@ except Exception:
     mp = None  # type: ignore
 
 
+FACE_CROP_MARGIN = 0.25
+
+# Adaptive detection: frames are first searched at DETECT_SIZE_LOW and only re-run at
+# DETECT_SIZE_HIGH when nothing confident was found. Faces smaller than MIN_FACE_SIZE
+# pixels or scored below MIN_DETECTION_SCORE are rejected before landmarks/embedding.
+DETECT_SIZE_LOW = int(os.getenv("DETECT_SIZE_LOW", "320"))
+DETECT_SIZE_HIGH = int(os.getenv("DETECT_SIZE_HIGH", "640"))
+DETECT_ADAPTIVE = os.getenv("DETECT_ADAPTIVE", "1") not in ("0", "false", "False")
+MIN_FACE_SIZE = int(os.getenv("MIN_FACE_SIZE", "64"))
+MIN_DETECTION_SCORE = float(os.getenv("MIN_DETECTION_SCORE", "0.6"))
+
+REJECT_NO_FACE = "no_face"
+REJECT_FACE_TOO_SMALL = "face_too_small"
+REJECT_LOW_QUALITY = "low_quality"
+
+
 @dataclass
-class FrameMetrics:
-    timestamp: float
-    ear_left: Optional[float]
-    ear_right: Optional[float]
-    mar: Optional[float]
+class DetectedFace:
+    bbox: np.ndarray
+    kps: np.ndarray
+    score: float
+
+
+@contextmanager
+def _timed(timings: Optional[Dict[str, float]], stage: str) -> Iterator[None]:
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + (time.perf_counter() - start)
 
 
 @dataclass
-class ClientState:
-    metrics: List[FrameMetrics] = field(default_factory=list)
-    last_seen: float = field(default_factory=lambda: time.time())
+class WorkerModels:
+    insightface: Optional[FaceAnalysis] = None
+    face_mesh: object = None
 
 
 class FaceEngine:
     def __init__(self) -> None:
-        self._insightface: Optional[FaceAnalysis] = None
-        self._mp_face_mesh = None
-        self._mp_drawing = None
-        self._cache_lock = threading.Lock()
-        self._client_cache: Dict[str, ClientState] = {}
+        # FaceMesh is stateful and neither it nor the ONNX sessions should be shared
+        # between threads, so every worker thread loads its own models.
+        self._local = threading.local()
+        self._models_lock = threading.Lock()
+        self._all_models: List[WorkerModels] = []
+        self._client_cache = ClientStateCache()
+        self._detect_lock = threading.Lock()
+        self._detect_counts: Dict[str, int] = {
+            "frames": 0,
+            "low_res": 0,
+            "escalated": 0,
+            "accepted": 0,
+            REJECT_NO_FACE: 0,
+            REJECT_FACE_TOO_SMALL: 0,
+            REJECT_LOW_QUALITY: 0,
+        }
 
     def startup(self) -> None:
-        if FaceAnalysis is not None:
-            self._insightface = FaceAnalysis(name="buffalo_l", providers=["CPUExecutionProvider"])  # type: ignore
-            self._insightface.prepare(ctx_id=0, det_size=(640, 640))
-        if mp is not None:
-            self._mp_face_mesh = mp.solutions.face_mesh.FaceMesh(static_image_mode=False, refine_landmarks=True)
-            self._mp_drawing = mp.solutions.drawing_utils
+        self._models()
 
     def shutdown(self) -> None:
-        if self._mp_face_mesh:
-            self._mp_face_mesh.close()
+        with self._models_lock:
+            for models in self._all_models:
+                if models.face_mesh:
+                    models.face_mesh.close()
+            self._all_models = []
+
+    def _models(self) -> WorkerModels:
+        models = getattr(self._local, "models", None)
+        if models is None:
+            models = WorkerModels()
+            if FaceAnalysis is not None:
+                models.insightface = FaceAnalysis(name="buffalo_l", providers=["CPUExecutionProvider"])  # type: ignore
+                models.insightface.prepare(ctx_id=0, det_size=(DETECT_SIZE_HIGH, DETECT_SIZE_HIGH))
+            if mp is not None:
+                models.face_mesh = mp.solutions.face_mesh.FaceMesh(static_image_mode=False, refine_landmarks=True)
+            self._local.models = models
+            with self._models_lock:
+                self._all_models.append(models)
+        return models
+
+    @property
+    def _insightface(self) -> Optional[FaceAnalysis]:
+        return self._models().insightface
+
+    @property
+    def _mp_face_mesh(self):
+        return self._models().face_mesh
 
     def decode_base64_image(self, image_base64: str) -> Optional[np.ndarray]:
         try:
             binary = base64.b64decode(image_base64.split(",")[-1])
-            img_array = np.frombuffer(binary, dtype=np.uint8)
+        except Exception:
+            return None
+        return self.decode_image_bytes(binary)
+
+    def decode_image_bytes(self, data: bytes) -> Optional[np.ndarray]:
+        try:
+            img_array = np.frombuffer(data, dtype=np.uint8)
             if cv2 is None:
                 return None
             image = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
@@ -70,6 +140,11 @@ class FaceEngine:
         except Exception:
             return None
 
+    def decode_image(self, image: Union[str, bytes]) -> Optional[np.ndarray]:
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            return self.decode_image_bytes(bytes(image))
+        return self.decode_base64_image(image)
+
     def extract_face_embedding(self, image_bgr: np.ndarray) -> Optional[np.ndarray]:
         if self._insightface is None:
             return None
@@ -83,6 +158,104 @@ class FaceEngine:
             return None
         return np.asarray(embedding, dtype=np.float32)
 
+    def _detect_largest_face(self, image_bgr: np.ndarray, det_size: Optional[int] = None) -> Optional[DetectedFace]:
+        insightface = self._insightface
+        det_model = getattr(insightface, "det_model", None) if insightface is not None else None
+        if det_model is None:
+            return None
+        input_size = (det_size, det_size) if det_size else None
+        bboxes, kpss = det_model.detect(image_bgr, input_size=input_size, max_num=0, metric="default")
+        if bboxes is None or bboxes.shape[0] == 0 or kpss is None:
+            return None
+        areas = (bboxes[:, 2] - bboxes[:, 0]) * (bboxes[:, 3] - bboxes[:, 1])
+        largest = int(np.argmax(areas))
+        return DetectedFace(bbox=bboxes[largest, :4], kps=kpss[largest], score=float(bboxes[largest, 4]))
+
+    @staticmethod
+    def _rejection(face: Optional[DetectedFace]) -> Optional[str]:
+        if face is None:
+            return REJECT_NO_FACE
+        if min(face.bbox[2] - face.bbox[0], face.bbox[3] - face.bbox[1]) < MIN_FACE_SIZE:
+            return REJECT_FACE_TOO_SMALL
+        if face.score < MIN_DETECTION_SCORE:
+            return REJECT_LOW_QUALITY
+        return None
+
+    def _detect_usable_face(self, image_bgr: np.ndarray) -> Tuple[Optional[DetectedFace], Optional[str]]:
+        # Cheap low-resolution pass first. A face that is too small there will not grow
+        # at higher resolution, so only missing or low-confidence faces escalate.
+        escalate = DETECT_ADAPTIVE and DETECT_SIZE_LOW < DETECT_SIZE_HIGH
+        face = self._detect_largest_face(image_bgr, DETECT_SIZE_LOW if escalate else DETECT_SIZE_HIGH)
+        rejection = self._rejection(face)
+        counts = ["frames", "low_res"] if escalate else ["frames"]
+        if escalate and rejection in (REJECT_NO_FACE, REJECT_LOW_QUALITY):
+            face = self._detect_largest_face(image_bgr, DETECT_SIZE_HIGH)
+            rejection = self._rejection(face)
+            counts.append("escalated")
+        counts.append(rejection or "accepted")
+        with self._detect_lock:
+            for key in counts:
+                self._detect_counts[key] += 1
+        return (face if rejection is None else None), rejection
+
+    def detection_stats(self) -> Dict[str, object]:
+        with self._detect_lock:
+            counts = dict(self._detect_counts)
+        return {
+            "adaptive": DETECT_ADAPTIVE,
+            "det_size_low": DETECT_SIZE_LOW,
+            "det_size_high": DETECT_SIZE_HIGH,
+            "min_face_size": MIN_FACE_SIZE,
+            "min_detection_score": MIN_DETECTION_SCORE,
+            **counts,
+        }
+
+    def _align_face(self, image_bgr: np.ndarray, face: DetectedFace) -> Optional[np.ndarray]:
+        rec_model = self._recognition_model()
+        if rec_model is None or face_align is None:
+            return None
+        return face_align.norm_crop(image_bgr, landmark=face.kps, image_size=rec_model.input_size[0])
+
+    def _recognition_model(self):
+        insightface = self._insightface
+        if insightface is None:
+            return None
+        return getattr(insightface, "models", {}).get("recognition")
+
+    def _embed_crops(self, crops: List[np.ndarray]) -> np.ndarray:
+        feats = np.asarray(self._recognition_model().get_feat(crops), dtype=np.float32).reshape(len(crops), -1)
+        norms = np.linalg.norm(feats, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return feats / norms
+
+    def _has_unified_path(self) -> bool:
+        insightface = self._insightface
+        return (
+            insightface is not None
+            and getattr(insightface, "det_model", None) is not None
+            and self._recognition_model() is not None
+            and face_align is not None
+        )
+
+    def extract_face_embeddings_batch(self, images_bgr: List[np.ndarray]) -> List[Optional[np.ndarray]]:
+        # Detection runs per image, but the aligned crops of all images go through
+        # the recognition model as a single batch.
+        if not self._has_unified_path():
+            return [self.extract_face_embedding(image) for image in images_bgr]
+        crops: List[np.ndarray] = []
+        owners: List[int] = []
+        for i, image in enumerate(images_bgr):
+            face = self._detect_largest_face(image)
+            crop = self._align_face(image, face) if face is not None else None
+            if crop is not None:
+                crops.append(crop)
+                owners.append(i)
+        results: List[Optional[np.ndarray]] = [None] * len(images_bgr)
+        if crops:
+            for row, owner in zip(self._embed_crops(crops), owners):
+                results[owner] = row
+        return results
+
     def _compute_eye_aspect_ratio(self, landmarks: List[Tuple[float, float]]) -> Optional[float]:
         if cv2 is None or len(landmarks) < 6:
             return None
@@ -102,38 +275,17 @@ class FaceEngine:
             return None
         return vertical / horizontal
 
-    def _update_client_metrics(self, client_id: str, frame_metrics: FrameMetrics) -> None:
-        with self._cache_lock:
-            state = self._client_cache.get(client_id, ClientState())
-            state.metrics.append(frame_metrics)
-            state.metrics = [m for m in state.metrics if time.time() - m.timestamp <= 8.0]
-            state.last_seen = time.time()
-            self._client_cache[client_id] = state
-
     def _estimate_liveness(self, client_id: str) -> bool:
-        with self._cache_lock:
-            state = self._client_cache.get(client_id)
-            if state is None:
-                return False
-            series = state.metrics
-        if len(series) < 5:
-            return False
-        ear_left_values = [m.ear_left for m in series if m.ear_left is not None]
-        ear_right_values = [m.ear_right for m in series if m.ear_right is not None]
-        mar_values = [m.mar for m in series if m.mar is not None]
-        def variation(values: List[float]) -> float:
-            if not values:
-                return 0.0
-            return float(np.percentile(values, 90) - np.percentile(values, 10))
-        ear_var = max(variation(ear_left_values), variation(ear_right_values))
-        mar_var = variation(mar_values)
-        return ear_var > 0.055 or mar_var > 0.08
+        return self._client_cache.is_live(client_id)
 
-    def analyze_frame_and_get_embedding(self, client_id: str, image_bgr: np.ndarray) -> Tuple[Optional[np.ndarray], bool]:
+    def liveness_stats(self) -> Dict[str, float]:
+        return self._client_cache.stats()
+
+    def _mesh_metrics(self, image_bgr: np.ndarray) -> Tuple[Optional[float], Optional[float], Optional[float]]:
         ear_left = None
         ear_right = None
         mar = None
-        if self._mp_face_mesh is not None and cv2 is not None:
+        if self._mp_face_mesh is not None and cv2 is not None and image_bgr.size:
             rgb = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB)
             result = self._mp_face_mesh.process(rgb)
             if result.multi_face_landmarks:
@@ -151,9 +303,79 @@ class FaceEngine:
                 ear_left = self._compute_eye_aspect_ratio(left_eye)
                 ear_right = self._compute_eye_aspect_ratio(right_eye)
                 mar = self._compute_mouth_aspect_ratio(mouth)
-        self._update_client_metrics(client_id, FrameMetrics(timestamp=time.time(), ear_left=ear_left, ear_right=ear_right, mar=mar))
-        liveness_ok = self._estimate_liveness(client_id)
-        embedding = self.extract_face_embedding(image_bgr)
+        return ear_left, ear_right, mar
+
+    @staticmethod
+    def _face_crop(image_bgr: np.ndarray, face: DetectedFace, margin: float = FACE_CROP_MARGIN) -> np.ndarray:
+        # Square crop around the detected box with some context so FaceMesh can lock on
+        h, w = image_bgr.shape[:2]
+        x1, y1, x2, y2 = face.bbox
+        cx, cy = (x1 + x2) / 2.0, (y1 + y2) / 2.0
+        half = max(x2 - x1, y2 - y1) * (0.5 + margin)
+        left, top = max(0, int(cx - half)), max(0, int(cy - half))
+        right, bottom = min(w, int(cx + half)), min(h, int(cy + half))
+        return image_bgr[top:bottom, left:right]
+
+    def _update_liveness(self, client_id: str, image_bgr: np.ndarray) -> bool:
+        # Full-frame FaceMesh pass; only used when no detector is available
+        return self._client_cache.record(client_id, *self._mesh_metrics(image_bgr))
+
+    def analyze_frame_and_get_embedding(self, client_id: str, image_bgr: np.ndarray) -> Tuple[Optional[np.ndarray], bool]:
+        embedding, liveness_ok, _ = self.analyze_frames_batch([(client_id, image_bgr)])[0]
+        return embedding, liveness_ok
+
+    def analyze_frames_batch(
+        self,
+        frames: List[Tuple[str, np.ndarray]],
+        timings: Optional[Dict[str, float]] = None,
+    ) -> List[Tuple[Optional[np.ndarray], bool, Optional[str]]]:
+        # One detector pass per frame feeds both the landmark model (run on the face
+        # crop only) and the aligned crop for the recognition model. Frames without a
+        # usable face stop after detection and carry the rejection reason instead.
+        if not self._has_unified_path():
+            with _timed(timings, "landmarks"):
+                liveness = [self._update_liveness(client_id, image) for client_id, image in frames]
+            with _timed(timings, "embed"):
+                embeddings = self.extract_face_embeddings_batch([image for _, image in frames])
+            return [
+                (embedding, live, None if embedding is not None else REJECT_NO_FACE)
+                for embedding, live in zip(embeddings, liveness)
+            ]
+
+        liveness: List[bool] = []
+        rejections: List[Optional[str]] = []
+        crops: List[np.ndarray] = []
+        owners: List[int] = []
+        for i, (client_id, image) in enumerate(frames):
+            with _timed(timings, "detect"):
+                face, rejection = self._detect_usable_face(image)
+            rejections.append(rejection)
+            if face is None:
+                liveness.append(self._client_cache.record(client_id, None, None, None))
+                continue
+            with _timed(timings, "landmarks"):
+                metrics = self._mesh_metrics(self._face_crop(image, face))
+            liveness.append(self._client_cache.record(client_id, *metrics))
+            with _timed(timings, "align"):
+                crop = self._align_face(image, face)
+            if crop is not None:
+                crops.append(crop)
+                owners.append(i)
+
+        embeddings: List[Optional[np.ndarray]] = [None] * len(frames)
+        if crops:
+            with _timed(timings, "embed"):
+                feats = self._embed_crops(crops)
+            for row, owner in zip(feats, owners):
+                embeddings[owner] = row
+        return list(zip(embeddings, liveness, rejections))
+
+    def analyze_frame_legacy(self, client_id: str, image_bgr: np.ndarray, timings: Optional[Dict[str, float]] = None) -> Tuple[Optional[np.ndarray], bool]:
+        # Previous two-detector path (full-frame FaceMesh + FaceAnalysis.get), kept for benchmarks
+        with _timed(timings, "landmarks"):
+            liveness_ok = self._update_liveness(client_id, image_bgr)
+        with _timed(timings, "detect+embed"):
+            embedding = self.extract_face_embedding(image_bgr)
         return embedding, liveness_ok
 
     @staticmethod
@@ -0,0 +1,433 @@
+from __future__ import annotations
+
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import func, or_, select
+from sqlalchemy.orm import Session
+
+from .ann import ANN_MIN_ROWS, ANN_NPROBE, GALLERY_INDEX, IVFIndex
+from .models import EMBEDDING_MODEL, FaceEmbedding, Student
+from .prototypes import GALLERY_PROTOTYPES, PROTOTYPE_MEDOIDS, PrototypeSet, build_prototypes, rerank, rows_by_student
+from .quantize import EMBEDDING_DTYPE, check_dtype, decode_vector, dequantize, quantize
+from .quantize import scores as _score
+from .shared_gallery import SharedGalleryStore, SharedSnapshot
+
+
+@dataclass
+class GalleryMatch:
+    student_id: int
+    similarity: float
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class EmbeddingGallery:
+    # Rows are L2-normalised so cosine similarity is a single matrix-vector product;
+    # _student_ids is kept parallel to the rows. Per-class slices of the matrix are
+    # built on first use and reused until the gallery changes. With index_kind="ivf"
+    # and at least ``min_rows`` rows, unfiltered searches go through an IVFIndex.
+    # Rows are held as ``dtype`` (float32, float16 or int8 with a per-row scale).
+    # Exact searches first score a few prototypes per student and re-rank the
+    # closest candidates on their raw rows.
+    def __init__(
+        self,
+        dim: Optional[int] = None,
+        index_kind: str = GALLERY_INDEX,
+        index_path: Optional[str] = None,
+        min_rows: int = ANN_MIN_ROWS,
+        nprobe: int = ANN_NPROBE,
+        dtype: str = EMBEDDING_DTYPE,
+        model_name: str = EMBEDDING_MODEL,
+        use_prototypes: bool = GALLERY_PROTOTYPES,
+        medoids: int = PROTOTYPE_MEDOIDS,
+    ) -> None:
+        if index_kind not in ("exact", "ivf"):
+            raise ValueError(f"Unknown gallery index: {index_kind}")
+        self.dtype = check_dtype(dtype)
+        self.model_name = model_name
+        self.skipped_rows = 0
+        self.use_prototypes = use_prototypes
+        self.medoids = medoids
+        self._protos = PrototypeSet(self.dtype)
+        self._rows_of: Dict[int, np.ndarray] = {}
+        self.index_kind = index_kind
+        self.index_path = index_path
+        self.min_rows = min_rows
+        self.nprobe = nprobe
+        self._index: Optional[IVFIndex] = None
+        # IVF (re)builds run here so mutations and searches never train inline
+        self._index_thread: Optional[threading.Thread] = None
+        self.index_builds = 0
+        self._lock = threading.RLock()
+        self._dim = dim
+        self._matrix = np.zeros((0, dim or 0), dtype=self.dtype)
+        self._scales = np.zeros((0,), dtype=np.float32)
+        self._student_ids = np.zeros((0,), dtype=np.int64)
+        self._class_of: Dict[int, Optional[str]] = {}
+        self._class_slices: Dict[Tuple[str, ...], Tuple[int, np.ndarray, np.ndarray, np.ndarray, PrototypeSet]] = {}
+        # bumped on every mutation so callers caching per-student rows can detect changes
+        self.generation = 0
+        self._shared: Optional[SharedGalleryStore] = None
+
+    def __len__(self) -> int:
+        return int(self._student_ids.shape[0])
+
+    @property
+    def dim(self) -> Optional[int]:
+        return self._dim
+
+    @contextmanager
+    def _mutation(self) -> Iterator[None]:
+        # With a shared store, mutations start from the latest published generation
+        # and publish the result so other worker processes pick it up.
+        if self._shared is None:
+            with self._lock:
+                yield
+                self.generation += 1
+            return
+        with self._shared.lock(), self._lock:
+            self._sync_locked()
+            yield
+            self._install(self._shared.publish(
+                self._matrix,
+                self._scales,
+                self._student_ids,
+                self._protos.matrix,
+                self._protos.scales,
+                self._protos.student_ids,
+                self._class_of,
+                self.model_name,
+            ))
+
+    def attach_shared(self, store: SharedGalleryStore, db: Session) -> None:
+        # Adopt the published gallery if it still matches the database, otherwise
+        # load from SQLite once and publish it for the other workers.
+        same_model = FaceEmbedding.model_name == self.model_name
+        if self.model_name == EMBEDDING_MODEL:
+            same_model = or_(same_model, FaceEmbedding.model_name.is_(None))
+        query = (
+            select(func.count(FaceEmbedding.id), func.coalesce(func.sum(FaceEmbedding.student_id), 0))
+            .join(Student, Student.id == FaceEmbedding.student_id)
+            .where(same_model)
+        )
+        with store.lock(), self._lock:
+            rows, id_sum = db.execute(query).one()
+            self._shared = store
+            fresh = store.matches(int(rows), int(id_sum), self.dtype, self.model_name, self._dim)
+            snapshot = store.adopt() if fresh else None
+            if snapshot is not None:
+                self._install(snapshot)
+            else:
+                self.load_from_db(db)
+
+    def sync(self) -> None:
+        if self._shared is not None and self._shared.generation() != self.generation:
+            with self._lock:
+                self._sync_locked()
+
+    def _sync_locked(self) -> None:
+        if self._shared is None or self._shared.generation() == self.generation:
+            return
+        snapshot = self._shared.adopt()
+        if snapshot is not None and snapshot.matrix.dtype == np.dtype(self.dtype):
+            self._install(snapshot)
+
+    def _install(self, snapshot: SharedSnapshot) -> None:
+        # switch to zero-copy views of a published generation
+        previous_ids, index = self._student_ids, self._index
+        self._matrix, self._scales, self._student_ids = snapshot.matrix, snapshot.scales, snapshot.student_ids
+        self._dim = int(snapshot.matrix.shape[1]) if snapshot.matrix.shape[0] else self._dim
+        self._protos = PrototypeSet.from_arrays(
+            self.dtype, snapshot.proto_matrix, snapshot.proto_scales, snapshot.proto_ids
+        )
+        self._rows_of = rows_by_student(self._student_ids)
+        self._class_of = dict(snapshot.class_of)
+        self._class_slices = {}
+        self.generation = snapshot.generation
+        if self.index_kind != "ivf":
+            return
+        old_rows = previous_ids.shape[0]
+        if (
+            index is not None
+            and len(index) == old_rows
+            and self._student_ids.shape[0] >= old_rows
+            and np.array_equal(self._student_ids[:old_rows], previous_ids)
+        ):
+            # rows were only appended; bucket the new ones against the existing lists
+            tail = dequantize(self._matrix[old_rows:], self._scales[old_rows:])
+            self._index = index.appended(tail) if tail.shape[0] else index
+        else:
+            # rows were removed or reordered; the background build reloads the
+            # publisher's saved index and only trains if that one is stale too
+            self._index = None
+        self._maybe_train()
+
+    def load_from_db(self, db: Session) -> None:
+        rows = db.execute(
+            select(FaceEmbedding.student_id, FaceEmbedding.vector, Student.class_name, FaceEmbedding.model_name)
+            .join(Student, Student.id == FaceEmbedding.student_id)
+            .order_by(FaceEmbedding.id)
+        ).all()
+        # rows from other embedding models are skipped; stored precision is read per blob
+        usable = [row for row in rows if (row[3] or EMBEDDING_MODEL) == self.model_name]
+        vectors = [decode_vector(vec_bytes) for _, vec_bytes, _, _ in usable]
+        student_ids = [student_id for student_id, _, _, _ in usable]
+        with self._mutation():
+            self._dim = None
+            self._matrix = np.zeros((0, 0), dtype=self.dtype)
+            self._scales = np.zeros((0,), dtype=np.float32)
+            self._student_ids = np.zeros((0,), dtype=np.int64)
+            self._class_of = {student_id: class_name for student_id, _, class_name, _ in usable}
+            self.skipped_rows = len(rows) - len(usable)
+            self._index = None
+            self._append(student_ids, vectors)
+            self._refresh_students(None)
+            if self.index_kind == "ivf" and self.index_path and len(self) >= self.min_rows:
+                self._index = IVFIndex.load(
+                    self.index_path, dequantize(self._matrix, self._scales), self._student_ids, self.nprobe
+                )
+            self._maybe_train()
+
+    def add(self, student_id: int, vectors: Sequence[np.ndarray], class_name: Optional[str] = None) -> None:
+        if not vectors:
+            return
+        with self._mutation():
+            first_row = len(self)
+            self._append([student_id] * len(vectors), vectors)
+            self._class_of[student_id] = class_name
+            self._refresh_students([student_id], first_row)
+            self._maybe_train()
+
+    def remove_student(self, student_id: int) -> None:
+        with self._mutation():
+            keep = self._student_ids != student_id
+            self._matrix = self._matrix[keep]
+            self._scales = self._scales[keep]
+            self._student_ids = self._student_ids[keep]
+            if self._index is not None:
+                self._index = self._index.kept(keep)
+            self._class_of.pop(student_id, None)
+            self._refresh_students([student_id])
+
+    def _append(self, student_ids: Iterable[int], vectors: Sequence[np.ndarray]) -> None:
+        if not vectors:
+            return
+        block = _normalize_rows(np.stack([np.asarray(v, dtype=np.float32).ravel() for v in vectors]))
+        if self._dim is None or self._matrix.shape[0] == 0:
+            self._dim = int(block.shape[1])
+            self._matrix = np.zeros((0, self._dim), dtype=self.dtype)
+            self._scales = np.zeros((0,), dtype=np.float32)
+        if block.shape[1] != self._dim:
+            raise ValueError(f"Embedding dimension {block.shape[1]} does not match gallery dimension {self._dim}")
+        stored, scales = quantize(block, self.dtype)
+        # Rebuild rather than mutate so concurrent readers holding the old arrays stay consistent.
+        self._matrix = np.ascontiguousarray(np.vstack([self._matrix, stored]))
+        self._scales = np.concatenate([self._scales, scales])
+        self._student_ids = np.concatenate([self._student_ids, np.asarray(list(student_ids), dtype=np.int64)])
+        if self._index is not None:
+            self._index = self._index.appended(block)
+
+    def _refresh_students(self, student_ids: Optional[Iterable[int]], first_new_row: Optional[int] = None) -> None:
+        # Recompute the prototypes of ``student_ids`` (all when None). When rows were
+        # only appended from ``first_new_row`` on, just those students' row lookups
+        # are extended; otherwise row positions moved and all are rebuilt.
+        if student_ids is not None and first_new_row is not None:
+            student_ids = list(student_ids)
+            rows_of = dict(self._rows_of)
+            tail = self._student_ids[first_new_row:]
+            for sid in student_ids:
+                extra = first_new_row + np.flatnonzero(tail == sid)
+                previous = rows_of.get(sid)
+                rows_of[sid] = extra if previous is None else np.concatenate([previous, extra])
+            self._rows_of = rows_of
+        else:
+            self._rows_of = rows_by_student(self._student_ids)
+        if not self.use_prototypes:
+            return
+        targets = self._rows_of.keys() if student_ids is None else student_ids
+        changes: Dict[int, Optional[np.ndarray]] = {}
+        for sid in targets:
+            rows = self._rows_of.get(sid)
+            if rows is None:
+                changes[sid] = None
+            else:
+                changes[sid] = build_prototypes(dequantize(self._matrix[rows], self._scales[rows]), self.medoids)
+        base = PrototypeSet(self.dtype) if student_ids is None else self._protos
+        self._protos = base.updated(changes)
+
+    def _wants_index(self) -> bool:
+        if self.index_kind != "ivf" or len(self) < self.min_rows:
+            return False
+        return self._index is None or self._index.needs_retrain()
+
+    def _maybe_train(self) -> None:
+        # caller holds the lock; searches stay on the current index (or exact
+        # search) until the background build swaps the new one in
+        if not self._wants_index():
+            return
+        if self._index_thread is not None and self._index_thread.is_alive():
+            return
+        self._index_thread = threading.Thread(target=self._build_index, name="gallery-ivf", daemon=True)
+        self._index_thread.start()
+
+    def _build_index(self) -> None:
+        trained: Optional[IVFIndex] = None
+        while True:
+            with self._lock:
+                if not self._wants_index():
+                    return
+                matrix, scales, student_ids = self._matrix, self._scales, self._student_ids
+            dense = dequantize(matrix, scales)
+            if trained is not None:
+                # the gallery changed while training: keep the centroids, re-bucket
+                index: Optional[IVFIndex] = IVFIndex(
+                    trained.centroids, IVFIndex._nearest(trained.centroids, dense), self.nprobe, trained.trained_rows
+                )
+            else:
+                index = IVFIndex.load(self.index_path, dense, student_ids, self.nprobe) if self.index_path else None
+                if index is None or index.needs_retrain():
+                    index = trained = IVFIndex.train(dense, nprobe=self.nprobe)
+            with self._lock:
+                # arrays are replaced on every mutation, so identity means unchanged
+                if self._student_ids is student_ids:
+                    self._index = index
+                    self.index_builds += 1
+                    break
+        if trained is not None and self.index_path:
+            index.save(self.index_path, student_ids)
+
+    def wait_for_index(self, timeout: Optional[float] = None) -> None:
+        thread = self._index_thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def save_index(self) -> None:
+        with self._lock:
+            index, student_ids = self._index, self._student_ids
+        if index is not None and self.index_path:
+            index.save(self.index_path, student_ids)
+
+    def index_stats(self) -> Dict[str, object]:
+        self.sync()
+        with self._lock:
+            index = self._index
+        return {
+            "kind": self.index_kind if index is not None else "exact",
+            "rows": len(self),
+            "lists": int(index.centroids.shape[0]) if index is not None else 0,
+            "nprobe": index.nprobe if index is not None else 0,
+            "building": self._index_thread is not None and self._index_thread.is_alive(),
+            "builds": self.index_builds,
+            "dtype": self.dtype,
+            "prototypes": len(self._protos) if self.use_prototypes else 0,
+            "matrix_bytes": int(self._matrix.nbytes + self._scales.nbytes),
+            "skipped_rows": self.skipped_rows,
+            "shared": self._shared.stats() if self._shared is not None else None,
+        }
+
+    def _snapshot(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        with self._lock:
+            return self._matrix, self._scales, self._student_ids
+
+    def class_of(self, student_id: int) -> Optional[str]:
+        return self._class_of.get(student_id)
+
+    def _class_snapshot(self, class_names: Sequence[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, PrototypeSet]:
+        key = tuple(sorted(set(class_names)))
+        with self._lock:
+            cached = self._class_slices.get(key)
+            if cached is not None and cached[0] == self.generation:
+                return cached[1], cached[2], cached[3], cached[4]
+            members = [sid for sid, name in self._class_of.items() if name in key]
+            keep = np.isin(self._student_ids, np.asarray(members, dtype=np.int64))
+            matrix = np.ascontiguousarray(self._matrix[keep])
+            scales = self._scales[keep]
+            student_ids = self._student_ids[keep]
+            self._class_slices = {k: v for k, v in self._class_slices.items() if v[0] == self.generation}
+            protos = self._protos.subset(members)
+            self._class_slices[key] = (self.generation, matrix, scales, student_ids, protos)
+            return matrix, scales, student_ids, protos
+
+    def student_vectors(self, student_id: int) -> Tuple[np.ndarray, int]:
+        self.sync()
+        with self._lock:
+            matrix, scales, student_ids, generation = self._matrix, self._scales, self._student_ids, self.generation
+        keep = student_ids == student_id
+        return dequantize(matrix[keep], scales[keep]), generation
+
+    def search(self, embedding: np.ndarray, top_k: int = 1) -> List[GalleryMatch]:
+        self.sync()
+        matrix, row_scales, student_ids = self._snapshot()
+        if student_ids.shape[0] == 0:
+            return []
+        query = _normalize_rows(embedding)[0]
+        if query.shape[0] != matrix.shape[1]:
+            return []
+        scores = _score(matrix, row_scales, query[None, :])[0]
+        if top_k == 1:
+            idx = int(np.argmax(scores))
+            return [GalleryMatch(student_id=int(student_ids[idx]), similarity=float(scores[idx]))]
+        # Best row per student: sort all scores, keep the first occurrence of each id.
+        order = np.argsort(-scores)
+        _, first = np.unique(student_ids[order], return_index=True)
+        best_rows = order[np.sort(first)][:top_k]
+        return [GalleryMatch(student_id=int(student_ids[i]), similarity=float(scores[i])) for i in best_rows]
+
+    def best_match(self, embedding: np.ndarray) -> Optional[GalleryMatch]:
+        matches = self.search(embedding, top_k=1)
+        return matches[0] if matches else None
+
+    def best_matches(
+        self, embeddings: List[Optional[np.ndarray]], class_names: Optional[Sequence[str]] = None
+    ) -> List[Optional[GalleryMatch]]:
+        # Scores every probe against the gallery (or only the rows of students in
+        # ``class_names``) with one matrix multiply.
+        self.sync()
+        index: Optional[IVFIndex] = None
+        # everything rerank reads must come from one generation: the class slice
+        # is taken under the same (reentrant) lock as the full matrix and rows_of
+        with self._lock:
+            all_matrix, all_scales, rows_of = self._matrix, self._scales, self._rows_of
+            if class_names:
+                matrix, row_scales, student_ids, protos = self._class_snapshot(class_names)
+            else:
+                matrix, row_scales, student_ids, index, protos = (
+                    self._matrix, self._scales, self._student_ids, self._index, self._protos
+                )
+        results: List[Optional[GalleryMatch]] = [None] * len(embeddings)
+        rows = [i for i, e in enumerate(embeddings) if e is not None and np.asarray(e).size == matrix.shape[1]]
+        if student_ids.shape[0] == 0 or not rows:
+            return results
+        probes = _normalize_rows(np.stack([np.asarray(embeddings[i], dtype=np.float32).ravel() for i in rows]))
+        if index is not None:
+            best_rows, best_scores = index.search(matrix, probes, row_scales)
+            for row, probe_idx in enumerate(rows):
+                if best_rows[row] >= 0:
+                    results[probe_idx] = GalleryMatch(
+                        student_id=int(student_ids[best_rows[row]]), similarity=float(best_scores[row])
+                    )
+            return results
+        if self.use_prototypes:
+            proto_scores = _score(protos.matrix, protos.scales, probes) if len(protos) else np.zeros((len(rows), 0))
+            ranked = rerank(protos, all_matrix, all_scales, rows_of, probes, proto_scores, medoids=self.medoids)
+            for probe_idx, best_pair in zip(rows, ranked):
+                if best_pair is not None:
+                    results[probe_idx] = GalleryMatch(student_id=best_pair[0], similarity=best_pair[1])
+            return results
+        scores = _score(matrix, row_scales, probes)
+        best = np.argmax(scores, axis=1)
+        for row, probe_idx in enumerate(rows):
+            idx = int(best[row])
+            results[probe_idx] = GalleryMatch(student_id=int(student_ids[idx]), similarity=float(scores[row, idx]))
+        return results
@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Set
+
+import numpy as np
+
+from .gallery import EmbeddingGallery, GalleryMatch
+
+IDENTITY_LOCK_SECONDS = float(os.getenv("IDENTITY_LOCK_SECONDS", "10"))
+IDENTITY_LOCK_THRESHOLD = float(os.getenv("IDENTITY_LOCK_THRESHOLD", "0.55"))
+IDENTITY_KEEP_THRESHOLD = float(os.getenv("IDENTITY_KEEP_THRESHOLD", "0.45"))
+IDENTITY_MAX_CLIENTS = int(os.getenv("IDENTITY_MAX_CLIENTS", "1024"))
+
+
+@dataclass
+class IdentityLock:
+    student_id: int
+    vectors: np.ndarray
+    generation: int
+    locked_at: float
+    student: Any = None
+    recorded_sessions: Set[str] = field(default_factory=set)
+
+
+class IdentityCache:
+    # Per-client lock-in of the last confidently matched student. While a lock is
+    # fresh, frames are only compared against that student's own gallery rows; a
+    # full gallery search runs again once similarity drops below ``keep_threshold``,
+    # the lock is older than ``ttl_seconds`` or the gallery has changed.
+    def __init__(
+        self,
+        gallery: EmbeddingGallery,
+        ttl_seconds: float = IDENTITY_LOCK_SECONDS,
+        lock_threshold: float = IDENTITY_LOCK_THRESHOLD,
+        keep_threshold: float = IDENTITY_KEEP_THRESHOLD,
+        max_clients: int = IDENTITY_MAX_CLIENTS,
+    ) -> None:
+        self.gallery = gallery
+        self.ttl_seconds = ttl_seconds
+        self.lock_threshold = lock_threshold
+        self.keep_threshold = keep_threshold
+        self.max_clients = max(1, max_clients)
+        self._lock = threading.Lock()
+        self._clients: "OrderedDict[str, IdentityLock]" = OrderedDict()
+        self._counts: Dict[str, int] = {"hits": 0, "misses": 0, "locked": 0, "dropped": 0, "expired": 0}
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+    def _count(self, key: str) -> None:
+        self._counts[key] += 1
+
+    def get(self, client_id: str) -> Optional[IdentityLock]:
+        with self._lock:
+            return self._clients.get(client_id)
+
+    def _fresh(self, client_id: str, now: float) -> Optional[IdentityLock]:
+        entry = self._clients.get(client_id)
+        if entry is None:
+            return None
+        if now - entry.locked_at > self.ttl_seconds or entry.generation != self.gallery.generation:
+            del self._clients[client_id]
+            self._count("expired")
+            return None
+        return entry
+
+    def match(self, client_id: str, embedding: np.ndarray) -> Optional[GalleryMatch]:
+        with self._lock:
+            entry = self._fresh(client_id, time.monotonic())
+            if entry is None:
+                self._count("misses")
+                return None
+        query = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = float(np.linalg.norm(query))
+        if entry.vectors.shape[0] == 0 or entry.vectors.shape[1] != query.shape[0] or norm == 0:
+            similarity = -1.0
+        else:
+            similarity = float(np.max(entry.vectors @ (query / norm)))
+        with self._lock:
+            if similarity < self.keep_threshold:
+                if self._clients.get(client_id) is entry:
+                    del self._clients[client_id]
+                self._count("dropped")
+                return None
+            self._count("hits")
+        return GalleryMatch(student_id=entry.student_id, similarity=similarity)
+
+    def observe(self, client_id: str, match: Optional[GalleryMatch]) -> None:
+        # Result of a full gallery search: lock in confident matches, clear otherwise.
+        if match is None or match.similarity < self.lock_threshold:
+            with self._lock:
+                self._clients.pop(client_id, None)
+            return
+        vectors, generation = self.gallery.student_vectors(match.student_id)
+        with self._lock:
+            previous = self._clients.get(client_id)
+            entry = IdentityLock(match.student_id, vectors, generation, time.monotonic())
+            if previous is not None and previous.student_id == match.student_id:
+                entry.student = previous.student
+                entry.recorded_sessions = previous.recorded_sessions
+            self._clients[client_id] = entry
+            self._clients.move_to_end(client_id)
+            while len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+            self._count("locked")
+
+    def remember(self, client_id: str, student_id: int, student: Any, recorded_session: Optional[str] = None) -> None:
+        with self._lock:
+            entry = self._clients.get(client_id)
+            if entry is None or entry.student_id != student_id:
+                return
+            entry.student = student
+            if recorded_session is not None:
+                entry.recorded_sessions.add(recorded_session)
+
+    def forget_student(self, student_id: int) -> None:
+        with self._lock:
+            for client_id in [c for c, e in self._clients.items() if e.student_id == student_id]:
+                del self._clients[client_id]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"clients": len(self._clients), "ttl_seconds": self.ttl_seconds, **self._counts}
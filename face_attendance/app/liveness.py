@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import bisect
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+LIVENESS_WINDOW_SECONDS = float(os.getenv("LIVENESS_WINDOW_SECONDS", "8.0"))
+# highest per-client frame rate whose whole window fits in the ring buffer;
+# beyond it the oldest samples are evicted before they leave the window
+LIVENESS_MAX_FPS = float(os.getenv("LIVENESS_MAX_FPS", "30"))
+LIVENESS_CAPACITY = int(os.getenv("LIVENESS_CAPACITY", str(math.ceil(LIVENESS_WINDOW_SECONDS * LIVENESS_MAX_FPS))))
+LIVENESS_CLIENT_TTL_SECONDS = float(os.getenv("LIVENESS_CLIENT_TTL_SECONDS", "300"))
+LIVENESS_MEMORY_CAP_MB = float(os.getenv("LIVENESS_MEMORY_CAP_MB", "64"))
+
+MIN_SAMPLES = 5
+EAR_VARIATION_THRESHOLD = 0.055
+MAR_VARIATION_THRESHOLD = 0.08
+
+# column order of ClientState.values
+EAR_LEFT, EAR_RIGHT, MAR = 0, 1, 2
+
+
+def _sorted_percentile(values: List[float], q: float) -> float:
+    # linear interpolation, same as np.percentile's default
+    pos = (len(values) - 1) * q / 100.0
+    lo = math.floor(pos)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+
+class ClientState:
+    # Fixed-capacity ring buffer of per-frame (EAR left, EAR right, MAR) samples.
+    # Each column also keeps a sorted copy of its window so the p90-p10 variation
+    # is read in O(1) and updated with one insert/remove per sample.
+    def __init__(self, capacity: int = LIVENESS_CAPACITY, window_seconds: float = LIVENESS_WINDOW_SECONDS) -> None:
+        self.capacity = capacity
+        self.window_seconds = window_seconds
+        self.timestamps = np.zeros(capacity, dtype=np.float64)
+        self.values = np.full((capacity, 3), np.nan, dtype=np.float32)
+        self.start = 0
+        self.count = 0
+        self.last_seen = time.monotonic()
+        self.lock = threading.Lock()
+        self._sorted: List[List[float]] = [[], [], []]
+
+    @staticmethod
+    def approx_bytes(capacity: int = LIVENESS_CAPACITY) -> int:
+        # ring arrays plus sorted float lists (~32 bytes per boxed float and slot)
+        return capacity * (8 + 3 * 4) + capacity * 3 * 32 + 512
+
+    def _evict_oldest(self) -> None:
+        row = self.values[self.start]
+        for col in range(3):
+            value = float(row[col])
+            if not math.isnan(value):
+                column = self._sorted[col]
+                idx = bisect.bisect_left(column, value)
+                if idx < len(column):
+                    column.pop(idx)
+        self.values[self.start] = np.nan
+        self.start = (self.start + 1) % self.capacity
+        self.count -= 1
+
+    def expire(self, now: float) -> None:
+        while self.count and now - self.timestamps[self.start] > self.window_seconds:
+            self._evict_oldest()
+
+    def append(self, now: float, ear_left: Optional[float], ear_right: Optional[float], mar: Optional[float]) -> None:
+        self.expire(now)
+        if self.count == self.capacity:
+            self._evict_oldest()
+        slot = (self.start + self.count) % self.capacity
+        self.timestamps[slot] = now
+        sample = (ear_left, ear_right, mar)
+        for col, value in enumerate(sample):
+            if value is None:
+                self.values[slot, col] = np.nan
+                continue
+            stored = float(np.float32(value))
+            self.values[slot, col] = stored
+            bisect.insort(self._sorted[col], stored)
+        self.count += 1
+        self.last_seen = now
+
+    def variation(self, col: int) -> float:
+        column = self._sorted[col]
+        if not column:
+            return 0.0
+        return _sorted_percentile(column, 90) - _sorted_percentile(column, 10)
+
+    def is_live(self) -> bool:
+        if self.count < MIN_SAMPLES:
+            return False
+        ear_var = max(self.variation(EAR_LEFT), self.variation(EAR_RIGHT))
+        return ear_var > EAR_VARIATION_THRESHOLD or self.variation(MAR) > MAR_VARIATION_THRESHOLD
+
+
+class ClientStateCache:
+    # LRU of ClientState keyed by client_id. The cache lock only covers dict
+    # operations; metric updates take the client's own lock. Clients idle longer
+    # than ``ttl_seconds`` are dropped and the total is capped by ``memory_cap_mb``.
+    def __init__(
+        self,
+        capacity: int = LIVENESS_CAPACITY,
+        window_seconds: float = LIVENESS_WINDOW_SECONDS,
+        ttl_seconds: float = LIVENESS_CLIENT_TTL_SECONDS,
+        memory_cap_mb: float = LIVENESS_MEMORY_CAP_MB,
+    ) -> None:
+        self.capacity = capacity
+        self.window_seconds = window_seconds
+        self.ttl_seconds = ttl_seconds
+        self.max_clients = max(1, int(memory_cap_mb * 1024 * 1024) // ClientState.approx_bytes(capacity))
+        self._lock = threading.Lock()
+        self._clients: "OrderedDict[str, ClientState]" = OrderedDict()
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+    def get(self, client_id: str) -> Optional[ClientState]:
+        with self._lock:
+            return self._clients.get(client_id)
+
+    def _get_or_create(self, client_id: str, now: float) -> ClientState:
+        with self._lock:
+            state = self._clients.get(client_id)
+            if state is None:
+                state = ClientState(self.capacity, self.window_seconds)
+                self._clients[client_id] = state
+            else:
+                self._clients.move_to_end(client_id)
+            state.last_seen = now
+            self._evict(now)
+            return state
+
+    def _evict(self, now: float) -> None:
+        while self._clients:
+            oldest_id, oldest = next(iter(self._clients.items()))
+            if len(self._clients) <= self.max_clients and now - oldest.last_seen <= self.ttl_seconds:
+                break
+            del self._clients[oldest_id]
+            self.evicted += 1
+
+    def record(self, client_id: str, ear_left: Optional[float], ear_right: Optional[float], mar: Optional[float]) -> bool:
+        now = time.monotonic()
+        state = self._get_or_create(client_id, now)
+        with state.lock:
+            state.append(now, ear_left, ear_right, mar)
+            return state.is_live()
+
+    def is_live(self, client_id: str) -> bool:
+        state = self.get(client_id)
+        if state is None:
+            return False
+        with state.lock:
+            state.expire(time.monotonic())
+            return state.is_live()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            clients = len(self._clients)
+        return {
+            "clients": clients,
+            "max_clients": self.max_clients,
+            "evicted": self.evicted,
+            "approx_bytes": clients * ClientState.approx_bytes(self.capacity),
+        }
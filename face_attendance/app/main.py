@@ -1,22 +1,33 @@
 from __future__ import annotations
 
+import asyncio
 import base64
 import io
+import os
 from datetime import datetime
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple, Union
 
 import numpy as np
-from fastapi import Depends, FastAPI, File, Form, HTTPException, Request, Response, UploadFile
+from fastapi import Depends, FastAPI, File, Form, HTTPException, Request, Response, UploadFile, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import HTMLResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from starlette.websockets import WebSocketState
 from sqlalchemy import select
 from sqlalchemy.orm import Session
 from pathlib import Path
 
-from .db import Base, engine, get_db
-from .face_engine import FaceEngine
-from .models import AttendanceRecord, AttendanceSession, FaceEmbedding, Student
+from .db import Base, SessionLocal, WriteSessionLocal, engine, get_db
+from .batching import MicroBatcher
+from .face_engine import REJECT_FACE_TOO_SMALL, REJECT_LOW_QUALITY, REJECT_NO_FACE, FaceEngine
+from .gallery import EmbeddingGallery, GalleryMatch
+from .identity import IdentityCache
+from .inference import InferencePool, PoolSaturated
+from .models import EMBEDDING_MODEL, AttendanceSession, FaceEmbedding, SessionClass, Student
+from .quantize import encode_vector
+from .roster import SessionRoster
+from .shared_gallery import GALLERY_SHARED_MEMORY, SharedGalleryStore
 from .schemas import FramePayload, RecognizeResult, SessionCreate, SessionOut, StudentCreate, StudentOut
 
 app = FastAPI(title="Face Attendance System", version="0.1.0")
@@ -26,19 +37,44 @@ app.mount("/static", StaticFiles(directory=str(BASE_DIR / "static")), name="stat
 templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))
 
 face_engine = FaceEngine()
+gallery = EmbeddingGallery(index_path=os.getenv("ANN_INDEX_PATH", str(BASE_DIR / "gallery_index.npz")))
+identity_cache = IdentityCache(gallery)
+roster = SessionRoster(SessionLocal, write_session_factory=WriteSessionLocal)
+# every inference worker thread loads its own models on start
+inference_pool = InferencePool(initializer=face_engine.startup)
+
+SIMILARITY_THRESHOLD = 0.45
+# search the whole gallery when a class-bound session finds no match in its roster
+CLASS_GALLERY_FALLBACK = os.getenv("CLASS_GALLERY_FALLBACK", "0") in ("1", "true", "True")
 
 
 @app.on_event("startup")
 def on_startup() -> None:
     Base.metadata.create_all(bind=engine)
-    face_engine.startup()
+    inference_pool.start()
+    roster.start()
+    with SessionLocal() as db:
+        if GALLERY_SHARED_MEMORY:
+            # worker processes share one published copy of the gallery
+            gallery.attach_shared(SharedGalleryStore(GALLERY_SHARED_MEMORY), db)
+        else:
+            gallery.load_from_db(db)
 
 
 @app.on_event("shutdown")
-def on_shutdown() -> None:
+async def on_shutdown() -> None:
+    await frame_batcher.shutdown()
+    inference_pool.shutdown()
+    roster.stop()
+    gallery.save_index()
     face_engine.shutdown()
 
 
+@app.exception_handler(PoolSaturated)
+async def pool_saturated_handler(request: Request, exc: PoolSaturated) -> JSONResponse:
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
+
 @app.get("/", response_class=HTMLResponse)
 def home(request: Request) -> HTMLResponse:
     return templates.TemplateResponse("index.html", {"request": request})
@@ -55,31 +91,17 @@ def create_session(payload: SessionCreate, db: Session = Depends(get_db)) -> Ses
     if exists is not None:
         raise HTTPException(status_code=400, detail="Session code already exists")
     session = AttendanceSession(session_code=payload.session_code, title=payload.title)
+    session.classes = [SessionClass(class_name=name) for name in dict.fromkeys(payload.class_names) if name]
     db.add(session)
     db.commit()
     db.refresh(session)
+    roster.session_created(session)
     return session
 
 
-@app.post("/api/register_student", response_model=StudentOut)
-async def register_student(
-    student_code: str = Form(...),
-    full_name: str = Form(...),
-    class_name: Optional[str] = Form(None),
-    files: List[UploadFile] = File(...),
-    db: Session = Depends(get_db),
-) -> StudentOut:
-    existing = db.scalar(select(Student).where(Student.student_code == student_code))
-    if existing is not None:
-        raise HTTPException(status_code=400, detail="Student code already exists")
-    student = Student(student_code=student_code, full_name=full_name, class_name=class_name)
-    db.add(student)
-    db.commit()
-    db.refresh(student)
-
-    imported = 0
-    for f in files:
-        content = await f.read()
+def _embed_uploads(contents: List[bytes]) -> List[np.ndarray]:
+    vectors: List[np.ndarray] = []
+    for content in contents:
         try:
             import cv2  # local import to avoid hard dependency when unavailable
             img_array = np.frombuffer(content, dtype=np.uint8)
@@ -91,85 +113,292 @@ async def register_student(
         embedding = face_engine.extract_face_embedding(image)
         if embedding is None:
             continue
-        vec_bytes = np.asarray(embedding, dtype=np.float32).tobytes()
-        emb = FaceEmbedding(student_id=student.id, vector=vec_bytes)
-        db.add(emb)
-        imported += 1
-    if imported == 0:
-        db.rollback()
-        raise HTTPException(status_code=400, detail="No faces detected in uploaded images")
+        vectors.append(np.asarray(embedding, dtype=np.float32))
+    return vectors
+
+
+def _student_code_exists(db: Session, student_code: str) -> bool:
+    return db.scalar(select(Student).where(Student.student_code == student_code)) is not None
+
+
+def _create_student(db: Session, student_code: str, full_name: str, class_name: Optional[str], vectors: List[np.ndarray]) -> Student:
+    student = Student(student_code=student_code, full_name=full_name, class_name=class_name)
+    db.add(student)
+    db.flush()
+    for vector in vectors:
+        db.add(FaceEmbedding(student_id=student.id, vector=encode_vector(vector), model_name=EMBEDDING_MODEL))
     db.commit()
     db.refresh(student)
     return student
 
 
-@app.post("/api/recognize_frame", response_model=RecognizeResult)
-async def recognize_frame(payload: FramePayload, db: Session = Depends(get_db)) -> RecognizeResult:
-    image = face_engine.decode_base64_image(payload.image_base64)
-    if image is None:
+@app.post("/api/register_student", response_model=StudentOut)
+async def register_student(
+    student_code: str = Form(...),
+    full_name: str = Form(...),
+    class_name: Optional[str] = Form(None),
+    files: List[UploadFile] = File(...),
+    db: Session = Depends(get_db),
+) -> StudentOut:
+    if await run_in_threadpool(_student_code_exists, db, student_code):
+        raise HTTPException(status_code=400, detail="Student code already exists")
+
+    contents = [await f.read() for f in files]
+    vectors = await inference_pool.run(_embed_uploads, contents)
+    if not vectors:
+        raise HTTPException(status_code=400, detail="No faces detected in uploaded images")
+    student = await run_in_threadpool(_create_student, db, student_code, full_name, class_name, vectors)
+    # copies the gallery arrays and may publish them; keep it off the event loop
+    await run_in_threadpool(gallery.add, student.id, vectors, class_name)
+    return student
+
+
+FrameAnalysis = Tuple[bool, Optional[np.ndarray], bool, Optional[str], Optional[GalleryMatch]]
+
+REJECTION_MESSAGES = {
+    REJECT_NO_FACE: "No face detected",
+    REJECT_FACE_TOO_SMALL: "Face too small, move closer to the camera",
+    REJECT_LOW_QUALITY: "Face unclear, face the camera in good lighting",
+}
+
+
+def _session_classes(session_code: Optional[str]) -> Tuple[str, ...]:
+    entry = roster.lookup(session_code)
+    return entry.class_names if entry is not None else ()
+
+
+def _search(embeddings: List[np.ndarray], class_names: Tuple[str, ...]) -> List[Optional[GalleryMatch]]:
+    if not class_names:
+        return gallery.best_matches(embeddings)
+    matches = gallery.best_matches(embeddings, class_names)
+    if CLASS_GALLERY_FALLBACK:
+        retry = [i for i, m in enumerate(matches) if m is None or m.similarity < SIMILARITY_THRESHOLD]
+        if retry:
+            for i, match in zip(retry, gallery.best_matches([embeddings[i] for i in retry])):
+                if match is not None and (matches[i] is None or match.similarity > matches[i].similarity):
+                    matches[i] = match
+    return matches
+
+
+def _analyze_frames(frames: List[Tuple[str, Union[str, bytes], Optional[str]]]) -> List[FrameAnalysis]:
+    # frames carry either base64 text (JSON API) or raw encoded bytes (binary APIs)
+    gallery.sync()
+    decoded = [(client_id, face_engine.decode_image(image)) for client_id, image, _ in frames]
+    valid = [(client_id, image) for client_id, image in decoded if image is not None]
+    analyzed = iter(face_engine.analyze_frames_batch(valid))
+    results: List[FrameAnalysis] = []
+    embeddings: List[Optional[np.ndarray]] = []
+    for _, image in decoded:
+        if image is None:
+            results.append((False, None, False, None, None))
+            embeddings.append(None)
+            continue
+        embedding, liveness_ok, rejection = next(analyzed)
+        results.append((True, embedding, liveness_ok, rejection, None))
+        embeddings.append(embedding)
+    # clients locked onto a student only need a check against that student's rows;
+    # the rest are searched within their session's class roster, grouped by roster
+    matches: List[Optional[GalleryMatch]] = [None] * len(frames)
+    to_search: Dict[Tuple[str, ...], List[int]] = {}
+    class_cache: Dict[Optional[str], Tuple[str, ...]] = {}
+    for i, ((client_id, _, session_code), embedding) in enumerate(zip(frames, embeddings)):
+        if embedding is None:
+            continue
+        if session_code not in class_cache:
+            class_cache[session_code] = _session_classes(session_code)
+        class_names = class_cache[session_code]
+        match = identity_cache.match(client_id, embedding)
+        if match is not None and (not class_names or gallery.class_of(match.student_id) in class_names):
+            matches[i] = match
+        else:
+            to_search.setdefault(class_names, []).append(i)
+    for class_names, indices in to_search.items():
+        searched = _search([embeddings[i] for i in indices], class_names)
+        for i, match in zip(indices, searched):
+            matches[i] = match
+            identity_cache.observe(frames[i][0], match)
+    return [result[:4] + (match,) for result, match in zip(results, matches)]
+
+
+frame_batcher = MicroBatcher(inference_pool, _analyze_frames)
+
+
+def _record_attendance(
+    db: Session, session_code: Optional[str], student_id: int, similarity: float, liveness_ok: bool
+) -> Tuple[Optional[Student], bool]:
+    student = db.get(Student, student_id)
+    if student is None:
+        return None, False
+
+    entry = roster.resolve(session_code)
+    if liveness_ok:
+        roster.mark(entry, student.id, similarity)
+    return student, student.id in entry.marked
+
+
+async def _recognize(client_id: str, session_code: Optional[str], image: Union[str, bytes], db: Session) -> RecognizeResult:
+    decoded, embedding, liveness_ok, rejection, match = await frame_batcher.submit((client_id, image, session_code))
+    if not decoded:
         raise HTTPException(status_code=400, detail="Invalid image data")
-    embedding, liveness_ok = face_engine.analyze_frame_and_get_embedding(payload.client_id, image)
     if embedding is None:
-        return RecognizeResult(recognized=False, liveness_ok=liveness_ok, student=None, similarity=None, message="No face detected")
+        rejection = rejection or REJECT_NO_FACE
+        return RecognizeResult(
+            recognized=False,
+            liveness_ok=liveness_ok,
+            student=None,
+            similarity=None,
+            message=REJECTION_MESSAGES.get(rejection, "No face detected"),
+            rejection=rejection,
+        )
 
-    embeddings = db.execute(select(FaceEmbedding.student_id, FaceEmbedding.vector)).all()
-    if not embeddings:
+    if len(gallery) == 0:
         return RecognizeResult(recognized=False, liveness_ok=liveness_ok, student=None, similarity=None, message="No enrolled students")
 
-    best_student_id = None
-    best_similarity = -1.0
-    for student_id, vec_bytes in embeddings:
-        vec = np.frombuffer(vec_bytes, dtype=np.float32)
-        sim = face_engine.cosine_similarity(embedding, vec)
-        if sim > best_similarity:
-            best_similarity = sim
-            best_student_id = student_id
-
-    threshold = 0.45
-    if best_student_id is None or best_similarity < threshold:
+    best_student_id = match.student_id if match is not None else None
+    best_similarity = match.similarity if match is not None else -1.0
+
+    if best_student_id is None or best_similarity < SIMILARITY_THRESHOLD:
         return RecognizeResult(recognized=False, liveness_ok=liveness_ok, student=None, similarity=float(best_similarity), message="Face not recognized")
 
-    student = db.get(Student, best_student_id)
-    if student is None:
-        return RecognizeResult(recognized=False, liveness_ok=liveness_ok, student=None, similarity=float(best_similarity), message="Student not found")
-
-    session: Optional[AttendanceSession] = None
-    if payload.session_code:
-        session = db.scalar(select(AttendanceSession).where(AttendanceSession.session_code == payload.session_code))
-        if session is None:
-            session = AttendanceSession(session_code=payload.session_code, title=f"Session {payload.session_code}")
-            db.add(session)
-            db.commit()
-            db.refresh(session)
+    # a locked-in client already recorded for this session skips the DB round trip
+    locked = identity_cache.get(client_id)
+    if (
+        locked is not None
+        and locked.student_id == best_student_id
+        and locked.student is not None
+        and session_code is not None
+        and session_code in locked.recorded_sessions
+    ):
+        student_out = locked.student
     else:
-        session = db.scalar(select(AttendanceSession).order_by(AttendanceSession.id.desc()))
-        if session is None:
-            session = AttendanceSession(session_code="default", title="Default Session")
-            db.add(session)
-            db.commit()
-            db.refresh(session)
-
-    exists = db.scalar(
-        select(AttendanceRecord).where(
-            AttendanceRecord.session_id == session.id,
-            AttendanceRecord.student_id == student.id,
+        student, recorded = await run_in_threadpool(
+            _record_attendance, db, session_code, best_student_id, float(best_similarity), liveness_ok
         )
-    )
-    if exists is None and liveness_ok:
-        record = AttendanceRecord(student_id=student.id, session_id=session.id, similarity=float(best_similarity))
-        db.add(record)
-        db.commit()
+        if student is None:
+            identity_cache.forget_student(best_student_id)
+            return RecognizeResult(recognized=False, liveness_ok=liveness_ok, student=None, similarity=float(best_similarity), message="Student not found")
+        student_out = StudentOut.model_validate(student)
+        identity_cache.remember(client_id, best_student_id, student_out, session_code if recorded else None)
 
     return RecognizeResult(
         recognized=True,
         liveness_ok=liveness_ok,
-        student=StudentOut.model_validate(student),
+        student=student_out,
         similarity=float(best_similarity),
         message=None,
     )
 
 
+@app.post("/api/recognize_frame", response_model=RecognizeResult)
+async def recognize_frame(payload: FramePayload, db: Session = Depends(get_db)) -> RecognizeResult:
+    return await _recognize(payload.client_id, payload.session_code, payload.image_base64, db)
+
+
+@app.post("/api/recognize_frame_raw", response_model=RecognizeResult)
+async def recognize_frame_raw(
+    request: Request,
+    client_id: str,
+    session_code: Optional[str] = None,
+    db: Session = Depends(get_db),
+) -> RecognizeResult:
+    content_type = request.headers.get("content-type", "")
+    if not content_type.startswith("image/"):
+        raise HTTPException(status_code=415, detail="Expected an image/jpeg body")
+    body = await request.body()
+    if not body:
+        raise HTTPException(status_code=400, detail="Invalid image data")
+    return await _recognize(client_id, session_code, body, db)
+
+
+@app.websocket("/ws/recognize")
+async def recognize_stream(websocket: WebSocket, client_id: str, session_code: Optional[str] = None) -> None:
+    # Each binary message is one encoded frame. Only the newest frame waiting to be
+    # processed is kept, so a slow server skips stale frames instead of lagging.
+    await websocket.accept()
+    latest: List[bytes] = []
+    frame_ready = asyncio.Event()
+    closed = asyncio.Event()
+    dropped = 0
+
+    async def receive_frames() -> None:
+        nonlocal dropped
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                data = message.get("bytes")
+                if not data:
+                    continue
+                if latest:
+                    dropped += 1
+                    latest.clear()
+                latest.append(data)
+                frame_ready.set()
+        finally:
+            closed.set()
+            frame_ready.set()
+
+    receiver = asyncio.create_task(receive_frames())
+    try:
+        with SessionLocal() as db:
+            while True:
+                await frame_ready.wait()
+                frame_ready.clear()
+                if not latest:
+                    if closed.is_set():
+                        break
+                    continue
+                data = latest.pop()
+                try:
+                    result = await _recognize(client_id, session_code, data, db)
+                    payload = {"type": "result", "dropped": dropped, **result.model_dump(mode="json")}
+                except HTTPException as exc:
+                    payload = {"type": "error", "dropped": dropped, "detail": exc.detail}
+                except PoolSaturated as exc:
+                    payload = {"type": "error", "dropped": dropped, "detail": str(exc)}
+                # the client may have gone away while this frame was processed
+                if closed.is_set() or websocket.client_state != WebSocketState.CONNECTED:
+                    break
+                try:
+                    await websocket.send_json(payload)
+                except RuntimeError:
+                    # sending on a socket that closed after the check above
+                    break
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+
+
 @app.get("/api/students", response_model=List[StudentOut])
 def list_students(db: Session = Depends(get_db)) -> List[StudentOut]:
     rows = db.scalars(select(Student).order_by(Student.created_at.desc())).all()
-    return [StudentOut.model_validate(s) for s in rows]
\ No newline at end of file
+    return [StudentOut.model_validate(s) for s in rows]
+
+
+@app.delete("/api/students/{student_id}")
+def delete_student(student_id: int, db: Session = Depends(get_db)) -> dict:
+    student = db.get(Student, student_id)
+    if student is None:
+        raise HTTPException(status_code=404, detail="Student not found")
+    # embeddings and attendance records go with the student via the ORM cascade
+    db.delete(student)
+    db.commit()
+    roster.forget_student(student_id)
+    gallery.remove_student(student_id)
+    identity_cache.forget_student(student_id)
+    return {"deleted": student_id}
+
+
+@app.get("/api/inference/stats")
+def inference_stats() -> dict:
+    return {
+        **inference_pool.stats(),
+        "batching": frame_batcher.stats(),
+        "liveness": face_engine.liveness_stats(),
+        "detection": face_engine.detection_stats(),
+        "identity": identity_cache.stats(),
+        "roster": roster.stats(),
+        "gallery": gallery.index_stats(),
+    }
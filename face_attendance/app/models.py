@@ -8,6 +8,9 @@ from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from .db import Base
 
+# embeddings from a different model are not comparable; the gallery only loads this one
+EMBEDDING_MODEL = "insightface-buffalo_l"
+
 
 class Student(Base):
     __tablename__ = "students"
@@ -28,7 +31,7 @@ class FaceEmbedding(Base):
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     student_id: Mapped[int] = mapped_column(ForeignKey("students.id", ondelete="CASCADE"), index=True)
     vector: Mapped[bytes] = mapped_column(LargeBinary)
-    model_name: Mapped[str] = mapped_column(String(64), default="insightface-buffalo_l")
+    model_name: Mapped[str] = mapped_column(String(64), default=EMBEDDING_MODEL)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
     student: Mapped[Student] = relationship("Student", back_populates="embeddings")
@@ -46,6 +49,23 @@ class AttendanceSession(Base):
     __table_args__ = (UniqueConstraint("session_code", name="uq_sessions_code"),)
 
     attendance_records: Mapped[List["AttendanceRecord"]] = relationship("AttendanceRecord", back_populates="session", cascade="all, delete-orphan")
+    classes: Mapped[List["SessionClass"]] = relationship("SessionClass", back_populates="session", cascade="all, delete-orphan", lazy="selectin")
+
+    @property
+    def class_names(self) -> List[str]:
+        return [c.class_name for c in self.classes]
+
+
+class SessionClass(Base):
+    __tablename__ = "session_classes"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    session_id: Mapped[int] = mapped_column(ForeignKey("sessions.id", ondelete="CASCADE"), index=True)
+    class_name: Mapped[str] = mapped_column(String(64))
+
+    __table_args__ = (UniqueConstraint("session_id", "class_name", name="uq_session_classes"),)
+
+    session: Mapped[AttendanceSession] = relationship("AttendanceSession", back_populates="classes")
 
 
 class AttendanceRecord(Base):
@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from .quantize import dequantize, quantize
+
+# First-pass search runs over a few prototypes per student instead of every photo
+GALLERY_PROTOTYPES = os.getenv("GALLERY_PROTOTYPES", "1") not in ("0", "false", "False")
+PROTOTYPE_MEDOIDS = int(os.getenv("PROTOTYPE_MEDOIDS", "2"))
+# candidates within this similarity of the best one are re-ranked on raw embeddings
+PROTOTYPE_MARGIN = float(os.getenv("PROTOTYPE_MARGIN", "0.05"))
+PROTOTYPE_RERANK = int(os.getenv("PROTOTYPE_RERANK", "5"))
+
+
+def build_prototypes(rows: np.ndarray, medoids: int = PROTOTYPE_MEDOIDS) -> np.ndarray:
+    # Normalised centroid plus up to ``medoids`` diverse photos: the one closest to
+    # the centroid, then greedily the photo least similar to those already chosen.
+    # Students with few photos simply keep all of them.
+    if rows.shape[0] <= medoids + 1:
+        return rows
+    centroid = rows.mean(axis=0)
+    norm = np.linalg.norm(centroid)
+    centroid = centroid / norm if norm > 0 else rows[0]
+    chosen = [int(np.argmax(rows @ centroid))]
+    closest = rows @ rows[chosen[0]]
+    while len(chosen) < medoids:
+        pick = int(np.argmin(closest))
+        chosen.append(pick)
+        closest = np.maximum(closest, rows @ rows[pick])
+    return np.vstack([centroid[None, :], rows[chosen]]).astype(np.float32)
+
+
+class PrototypeSet:
+    # Per-student prototypes flattened into one (possibly quantized) matrix with a
+    # parallel student id array. Like the gallery arrays it is replaced on change.
+    def __init__(self, dtype: str, per_student: Optional[Dict[int, np.ndarray]] = None) -> None:
+        self.dtype = dtype
+        blocks = list((per_student or {}).items())
+        if blocks:
+            stacked = np.vstack([protos for _, protos in blocks])
+            self.matrix, self.scales = quantize(stacked, dtype)
+            self.student_ids = np.concatenate(
+                [np.full(protos.shape[0], sid, dtype=np.int64) for sid, protos in blocks]
+            )
+        else:
+            self.matrix = np.zeros((0, 0), dtype=dtype)
+            self.scales = np.zeros((0,), dtype=np.float32)
+            self.student_ids = np.zeros((0,), dtype=np.int64)
+
+    @classmethod
+    def from_arrays(cls, dtype: str, matrix: np.ndarray, scales: np.ndarray, student_ids: np.ndarray) -> "PrototypeSet":
+        protos = cls(dtype)
+        protos.matrix, protos.scales, protos.student_ids = matrix, scales, student_ids
+        return protos
+
+    def __len__(self) -> int:
+        return int(self.student_ids.shape[0])
+
+    def per_student(self) -> Dict[int, np.ndarray]:
+        return {
+            sid: dequantize(self.matrix[rows], self.scales[rows])
+            for sid, rows in rows_by_student(self.student_ids).items()
+        }
+
+    def updated(self, changes: Dict[int, Optional[np.ndarray]]) -> "PrototypeSet":
+        # Only the changed students are (re)quantized; everyone else's rows are
+        # carried over as stored.
+        if not changes:
+            return self
+        if not len(self):
+            return PrototypeSet(self.dtype, {sid: p for sid, p in changes.items() if p is not None and p.shape[0]})
+        stale = np.isin(self.student_ids, np.fromiter(changes.keys(), dtype=np.int64, count=len(changes)))
+        added = PrototypeSet(self.dtype, {sid: p for sid, p in changes.items() if p is not None and p.shape[0]})
+        keep = ~stale
+        kept = int(keep.sum())
+        # one new matrix, filled in place: kept rows first (copied run by run, a
+        # student's rows are contiguous), then the changed students
+        matrix = np.empty((kept + len(added), self.matrix.shape[1]), dtype=self.matrix.dtype)
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], keep.view(np.int8), [0]))))
+        offset = 0
+        for start, end in zip(edges[::2], edges[1::2]):
+            matrix[offset:offset + end - start] = self.matrix[start:end]
+            offset += end - start
+        if len(added):
+            matrix[kept:] = added.matrix
+        scales = np.concatenate([self.scales[keep], added.scales])
+        student_ids = np.concatenate([self.student_ids[keep], added.student_ids])
+        return PrototypeSet.from_arrays(self.dtype, matrix, scales, student_ids)
+
+    def subset(self, student_ids: Iterable[int]) -> "PrototypeSet":
+        keep = np.isin(self.student_ids, np.asarray(list(student_ids), dtype=np.int64))
+        return PrototypeSet.from_arrays(
+            self.dtype, np.ascontiguousarray(self.matrix[keep]), self.scales[keep], self.student_ids[keep]
+        )
+
+
+def rows_by_student(student_ids: np.ndarray) -> Dict[int, np.ndarray]:
+    if student_ids.shape[0] == 0:
+        return {}
+    order = np.argsort(student_ids, kind="stable")
+    unique, starts = np.unique(student_ids[order], return_index=True)
+    bounds = list(starts) + [order.shape[0]]
+    return {int(sid): order[bounds[i] : bounds[i + 1]] for i, sid in enumerate(unique)}
+
+
+def rerank(
+    protos: PrototypeSet,
+    matrix: np.ndarray,
+    scales: np.ndarray,
+    rows_of: Dict[int, np.ndarray],
+    probes: np.ndarray,
+    proto_scores: np.ndarray,
+    margin: float = PROTOTYPE_MARGIN,
+    limit: int = PROTOTYPE_RERANK,
+    medoids: int = PROTOTYPE_MEDOIDS,
+) -> List[Optional[Tuple[int, float]]]:
+    # For each probe pick candidate students from the prototype scores, then score
+    # their raw photos. Only the best student is checked unless others are within
+    # ``margin``; the reported similarity always comes from a raw photo.
+    results: List[Optional[Tuple[int, float]]] = []
+    for probe, row in zip(probes, proto_scores):
+        if row.shape[0] == 0:
+            results.append(None)
+            continue
+        k = min(row.shape[0], max(1, limit) * (medoids + 1))
+        order = np.argpartition(-row, k - 1)[:k] if k < row.shape[0] else np.arange(row.shape[0])
+        order = order[np.argsort(-row[order])]
+        candidates: List[int] = []
+        top = float(row[order[0]])
+        for idx in order:
+            if float(row[idx]) < top - margin or len(candidates) >= max(1, limit):
+                break
+            sid = int(protos.student_ids[idx])
+            if sid not in candidates:
+                candidates.append(sid)
+        best: Optional[Tuple[int, float]] = None
+        for sid in candidates:
+            rows = rows_of.get(sid)
+            if rows is None or rows.shape[0] == 0:
+                continue
+            similarity = float(np.max(dequantize(matrix[rows], scales[rows]) @ probe))
+            if best is None or similarity > best[1]:
+                best = (sid, similarity)
+        results.append(best)
+    return results
@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import os
+import struct
+from typing import Optional, Tuple
+
+import numpy as np
+
+# Storage precision for embeddings, both the SQLite blob and the in-memory gallery
+EMBEDDING_DTYPE = os.getenv("EMBEDDING_DTYPE", "float32")
+DTYPES = ("float32", "float16", "int8")
+
+# blob header: magic, dtype code, dim (uint16), int8 scale (float32)
+_MAGIC = b"QE"
+_HEADER = struct.Struct("<2sBHf")
+_CODES = {"float32": 0, "float16": 1, "int8": 2}
+_NAMES = {code: name for name, code in _CODES.items()}
+
+
+def check_dtype(dtype: str) -> str:
+    if dtype not in DTYPES:
+        raise ValueError(f"Unknown embedding dtype: {dtype}")
+    return dtype
+
+
+def quantize(rows: np.ndarray, dtype: str) -> Tuple[np.ndarray, np.ndarray]:
+    # Returns the stored matrix and a per-row scale (1.0 unless int8). int8 rows are
+    # scaled so their largest component maps to 127.
+    rows = np.atleast_2d(np.asarray(rows, dtype=np.float32))
+    scales = np.ones(rows.shape[0], dtype=np.float32)
+    if check_dtype(dtype) == "float32":
+        return np.ascontiguousarray(rows), scales
+    if dtype == "float16":
+        return rows.astype(np.float16), scales
+    peak = np.abs(rows).max(axis=1)
+    scales = np.where(peak > 0, peak / 127.0, 1.0).astype(np.float32)
+    quantized = np.clip(np.rint(rows / scales[:, None]), -127, 127).astype(np.int8)
+    return quantized, scales
+
+
+def dequantize(matrix: np.ndarray, scales: Optional[np.ndarray] = None) -> np.ndarray:
+    out = np.asarray(matrix, dtype=np.float32)
+    if matrix.dtype == np.int8 and scales is not None:
+        out = out * scales[:, None]
+    return out
+
+
+def scores(matrix: np.ndarray, scales: np.ndarray, probes: np.ndarray, chunk: int = 8192) -> np.ndarray:
+    # (Q, N) dot products. Compact rows are widened to float32 one chunk at a time so
+    # the BLAS matmul is kept while the resident matrix stays 2x/4x smaller.
+    if matrix.dtype == np.float32:
+        return probes @ matrix.T
+    out = np.empty((probes.shape[0], matrix.shape[0]), dtype=np.float32)
+    for start in range(0, matrix.shape[0], chunk):
+        block = matrix[start : start + chunk].astype(np.float32)
+        out[:, start : start + block.shape[0]] = probes @ block.T
+    if matrix.dtype == np.int8:
+        out *= scales[None, :]
+    return out
+
+
+def encode_vector(vector: np.ndarray, dtype: str = EMBEDDING_DTYPE) -> bytes:
+    vector = np.asarray(vector, dtype=np.float32).ravel()
+    if dtype == "float32":
+        # plain float32 bytes, same as rows written before quantization existed
+        return vector.tobytes()
+    norm = float(np.linalg.norm(vector))
+    if norm > 0:
+        vector = vector / norm
+    quantized, scales = quantize(vector, dtype)
+    return _HEADER.pack(_MAGIC, _CODES[dtype], vector.shape[0], float(scales[0])) + quantized.tobytes()
+
+
+def decode_vector(blob: bytes) -> np.ndarray:
+    if len(blob) > _HEADER.size and blob[:2] == _MAGIC:
+        magic, code, dim, scale = _HEADER.unpack_from(blob)
+        name = _NAMES.get(code)
+        if name is not None and _HEADER.size + dim * np.dtype(name).itemsize == len(blob):
+            data = np.frombuffer(blob, dtype=name, offset=_HEADER.size)
+            out = data.astype(np.float32)
+            return out * np.float32(scale) if name == "int8" else out
+    return np.frombuffer(blob, dtype=np.float32)
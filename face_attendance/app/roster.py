@@ -0,0 +1,260 @@
+from __future__ import annotations
+
+import os
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .models import AttendanceRecord, AttendanceSession
+
+ROSTER_FLUSH_INTERVAL = float(os.getenv("ROSTER_FLUSH_INTERVAL", "1.0"))
+ROSTER_BATCH_SIZE = int(os.getenv("ROSTER_BATCH_SIZE", "500"))
+# how long an ended or unknown session code is answered without asking the DB
+ROSTER_MISS_TTL = float(os.getenv("ROSTER_MISS_TTL", "30"))
+
+DEFAULT_SESSION_CODE = "default"
+
+
+@dataclass
+class SessionEntry:
+    id: int
+    session_code: str
+    ends_at: Optional[datetime]
+    class_names: Tuple[str, ...] = ()
+    marked: Set[int] = field(default_factory=set)
+
+    def expired(self, now: datetime) -> bool:
+        return self.ends_at is not None and self.ends_at <= now
+
+
+@dataclass
+class PendingRecord:
+    student_id: int
+    session_id: int
+    similarity: float
+    recognized_at: datetime
+
+
+class SessionRoster:
+    # Active sessions with the set of students already marked in each, so the
+    # per-frame dedupe is a set lookup. New records are queued and written by a
+    # background thread in batched transactions. Sessions are loaded from the DB on
+    # first use and dropped once ``ends_at`` has passed.
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        flush_interval: float = ROSTER_FLUSH_INTERVAL,
+        batch_size: int = ROSTER_BATCH_SIZE,
+        write_session_factory: Optional[Callable[[], Session]] = None,
+    ) -> None:
+        self.session_factory = session_factory
+        # batched inserts can use a dedicated connection apart from the lookups
+        self.write_session_factory = write_session_factory or session_factory
+        self.flush_interval = flush_interval
+        self.batch_size = max(1, batch_size)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._sessions: Dict[str, SessionEntry] = {}
+        self._latest_code: Optional[str] = None
+        # code ("" for the default session) -> (expired entry or None, valid until)
+        self._misses: Dict[str, Tuple[Optional[SessionEntry], datetime]] = {}
+        self._pending: List[PendingRecord] = []
+        self.warmed = 0
+        self.evicted = 0
+        self.flushes = 0
+        self.rows_written = 0
+        self.failures = 0
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="roster-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5.0)
+            self._thread = None
+        self.flush()
+
+    def _load(self, db: Session, session: AttendanceSession) -> SessionEntry:
+        marked = db.scalars(select(AttendanceRecord.student_id).where(AttendanceRecord.session_id == session.id)).all()
+        entry = SessionEntry(
+            id=session.id,
+            session_code=session.session_code,
+            ends_at=session.ends_at,
+            class_names=tuple(session.class_names),
+            marked=set(marked),
+        )
+        with self._lock:
+            # records queued but not yet flushed are not in the DB yet
+            entry.marked.update(p.student_id for p in self._pending if p.session_id == session.id)
+        self.warmed += 1
+        return entry
+
+    def _warm(self, session_code: Optional[str], create: bool) -> Tuple[Optional[SessionEntry], bool]:
+        # also reports whether the session row was created here
+        created = False
+        with self.session_factory() as db:
+            if session_code:
+                session = db.scalar(select(AttendanceSession).where(AttendanceSession.session_code == session_code))
+                if session is None:
+                    if not create:
+                        return None, False
+                    session = AttendanceSession(session_code=session_code, title=f"Session {session_code}")
+                    db.add(session)
+                    db.commit()
+                    db.refresh(session)
+                    created = True
+            else:
+                session = db.scalar(select(AttendanceSession).order_by(AttendanceSession.id.desc()))
+                if session is None:
+                    if not create:
+                        return None, False
+                    session = AttendanceSession(session_code=DEFAULT_SESSION_CODE, title="Default Session")
+                    db.add(session)
+                    db.commit()
+                    db.refresh(session)
+                    created = True
+            return self._load(db, session), created
+
+    def resolve(self, session_code: Optional[str]) -> SessionEntry:
+        entry = self.lookup(session_code, create=True)
+        assert entry is not None
+        return entry
+
+    def lookup(self, session_code: Optional[str], create: bool = False) -> Optional[SessionEntry]:
+        now = datetime.utcnow()
+        key = session_code or ""
+        with self._lock:
+            self._evict(now)
+            code = session_code or self._latest_code
+            entry = self._sessions.get(code) if code else None
+            if entry is not None:
+                return entry
+            miss = self._misses.get(key)
+            if miss is not None and miss[1] > now and (miss[0] is not None or not create):
+                return miss[0]
+        entry, created = self._warm(session_code, create)
+        with self._lock:
+            if entry is None or entry.expired(now):
+                # ended sessions are never cached as active; remember the answer briefly
+                self._misses[key] = (entry, now + timedelta(seconds=ROSTER_MISS_TTL))
+                return entry
+            self._misses.pop(key, None)
+            if not session_code or created:
+                # an auto-created session is the newest one, as with session_created
+                self._latest_code = entry.session_code
+                self._misses.pop("", None)
+            # another thread may have warmed the same session meanwhile
+            return self._sessions.setdefault(entry.session_code, entry)
+
+    def _evict(self, now: datetime) -> None:
+        for code in [c for c, e in self._sessions.items() if e.expired(now)]:
+            del self._sessions[code]
+            if self._latest_code == code:
+                self._latest_code = None
+            self.evicted += 1
+
+    def session_created(self, session: AttendanceSession) -> None:
+        # a newer session becomes the default for frames without a session code
+        with self._lock:
+            self._latest_code = None
+            self._misses.clear()
+            if not session.ends_at or session.ends_at > datetime.utcnow():
+                self._sessions[session.session_code] = SessionEntry(
+                    id=session.id,
+                    session_code=session.session_code,
+                    ends_at=session.ends_at,
+                    class_names=tuple(session.class_names),
+                )
+                self._latest_code = session.session_code
+
+    def mark(self, entry: SessionEntry, student_id: int, similarity: float) -> bool:
+        # True when this call marked the student; False when already present
+        with self._lock:
+            if student_id in entry.marked:
+                return False
+            entry.marked.add(student_id)
+            self._pending.append(PendingRecord(student_id, entry.id, similarity, datetime.utcnow()))
+            pending = len(self._pending)
+        if pending >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    def forget_student(self, student_id: int) -> None:
+        with self._flush_lock, self._lock:
+            for entry in self._sessions.values():
+                entry.marked.discard(student_id)
+            self._pending = [p for p in self._pending if p.student_id != student_id]
+
+    def flush(self) -> int:
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if not pending:
+                return 0
+            try:
+                self._write(pending)
+            except Exception:
+                # keep the batch queued and retry on the next flush
+                self.failures += 1
+                with self._lock:
+                    self._pending = pending + self._pending
+                return 0
+            self.flushes += 1
+            self.rows_written += len(pending)
+            return len(pending)
+
+    def _write(self, pending: List[PendingRecord]) -> None:
+        with self.write_session_factory() as db:
+            session_ids = {p.session_id for p in pending}
+            # guards against rows written by another process since the session was warmed
+            rows = db.execute(
+                select(AttendanceRecord.session_id, AttendanceRecord.student_id).where(
+                    AttendanceRecord.session_id.in_(session_ids)
+                )
+            ).all()
+            existing: Set[Tuple[int, int]] = {(session_id, student_id) for session_id, student_id in rows}
+            db.add_all(
+                AttendanceRecord(
+                    student_id=p.student_id,
+                    session_id=p.session_id,
+                    similarity=p.similarity,
+                    recognized_at=p.recognized_at,
+                )
+                for p in pending
+                if (p.session_id, p.student_id) not in existing
+            )
+            db.commit()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+            with self._lock:
+                self._evict(datetime.utcnow())
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "marked": sum(len(e.marked) for e in self._sessions.values()),
+                "pending": len(self._pending),
+                "warmed": self.warmed,
+                "evicted": self.evicted,
+                "flushes": self.flushes,
+                "rows_written": self.rows_written,
+                "failures": self.failures,
+            }
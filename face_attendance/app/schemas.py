@@ -26,6 +26,7 @@ class StudentOut(BaseModel):
 class SessionCreate(BaseModel):
     session_code: str = Field(description="Human-friendly code to identify the session")
     title: str
+    class_names: List[str] = Field(default_factory=list, description="Restrict recognition to students of these classes")
 
 
 class SessionOut(BaseModel):
@@ -34,6 +35,7 @@ class SessionOut(BaseModel):
     title: str
     starts_at: datetime
     ends_at: Optional[datetime]
+    class_names: List[str] = []
 
     class Config:
         from_attributes = True
@@ -50,4 +52,5 @@ class RecognizeResult(BaseModel):
     liveness_ok: bool
     student: Optional[StudentOut]
     similarity: Optional[float]
-    message: Optional[str] = None
\ No newline at end of file
+    message: Optional[str] = None
+    rejection: Optional[str] = None
\ No newline at end of file
@@ -0,0 +1,252 @@
+from __future__ import annotations
+
+import json
+import os
+import struct
+import sys
+import tempfile
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - shared galleries need POSIX file locks
+    fcntl = None  # type: ignore
+
+# Name prefix of the shared-memory segments; empty keeps the gallery process-local
+GALLERY_SHARED_MEMORY = os.getenv("GALLERY_SHARED_MEMORY", "")
+
+# control segment: layout tag, generation, embedding row count, sum of student
+# ids, dim, dtype and embedding model. Segments outlive restarts, so a gallery
+# only adopts one whose fingerprint matches its own configuration.
+_CONTROL = struct.Struct("<4sqqqq8s32s")
+_CONTROL_TAG = b"GAL2"
+# data segment header: rows, dim, prototype rows, dtype length, class json length
+_HEADER = struct.Struct("<qqqqq")
+
+
+def _untrack(shm: shared_memory.SharedMemory) -> None:
+    # Segments outlive the process that created them; stop the resource tracker
+    # from unlinking them when that worker exits.
+    try:
+        resource_tracker.unregister(shm._name, "shared_memory")  # type: ignore[attr-defined]
+    except Exception:
+        pass
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+@dataclass
+class SharedSnapshot:
+    generation: int
+    matrix: np.ndarray
+    scales: np.ndarray
+    student_ids: np.ndarray
+    proto_matrix: np.ndarray
+    proto_scales: np.ndarray
+    proto_ids: np.ndarray
+    class_of: Dict[int, Optional[str]]
+
+
+class SharedGalleryStore:
+    # Publishes gallery arrays to POSIX shared memory so every worker process maps
+    # the same pages. Each publish writes a new immutable data segment named after
+    # its generation and then bumps the generation in a small control segment;
+    # readers compare generations and re-map when it moved. Publishers serialise on
+    # an flock so concurrent registrations in different workers do not race.
+    def __init__(self, name: str, lock_dir: Optional[str] = None) -> None:
+        if fcntl is None:
+            raise RuntimeError("Shared galleries require fcntl (POSIX)")
+        self.name = name
+        self._lock_path = os.path.join(lock_dir or tempfile.gettempdir(), f"{name}.lock")
+        self._thread_lock = threading.RLock()
+        self._lock_depth = 0
+        self._lock_file = None
+        self._control = self._open_control()
+        # (segment, mmap refcount before any array views were created)
+        self._segment: Optional[Tuple[shared_memory.SharedMemory, int]] = None
+        self._retired: List[Tuple[shared_memory.SharedMemory, int]] = []
+        self.publishes = 0
+        self.adoptions = 0
+
+    def _open_control(self) -> shared_memory.SharedMemory:
+        with self.lock():
+            try:
+                control = shared_memory.SharedMemory(name=f"{self.name}_ctl")
+            except FileNotFoundError:
+                control = None
+            if control is not None and (control.size < _CONTROL.size or bytes(control.buf[:4]) != _CONTROL_TAG):
+                # left behind by an older layout: drop it and its data segment
+                # (unlink() also drops the resource tracker registration)
+                previous = struct.unpack_from("<q", control.buf, 0)[0] if control.size >= 8 else 0
+                control.close()
+                control.unlink()
+                self._unlink(previous)
+                control = None
+            if control is None:
+                control = shared_memory.SharedMemory(name=f"{self.name}_ctl", create=True, size=_CONTROL.size)
+                _CONTROL.pack_into(control.buf, 0, _CONTROL_TAG, 0, -1, 0, 0, b"", b"")
+        _untrack(control)
+        return control
+
+    @contextmanager
+    def lock(self) -> Iterator[None]:
+        # re-entrant within a thread; exclusive across threads and processes
+        with self._thread_lock:
+            if self._lock_depth == 0:
+                self._lock_file = open(self._lock_path, "a+")
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0 and self._lock_file is not None:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+                    self._lock_file.close()
+                    self._lock_file = None
+
+    def state(self) -> Tuple[int, int, int, int, str, str]:
+        _, generation, rows, id_sum, dim, dtype, model = _CONTROL.unpack_from(self._control.buf, 0)
+        return generation, rows, id_sum, dim, dtype.rstrip(b"\0").decode(), model.rstrip(b"\0").decode()
+
+    def generation(self) -> int:
+        return self.state()[0]
+
+    def publish(
+        self,
+        matrix: np.ndarray,
+        scales: np.ndarray,
+        student_ids: np.ndarray,
+        proto_matrix: np.ndarray,
+        proto_scales: np.ndarray,
+        proto_ids: np.ndarray,
+        class_of: Dict[int, Optional[str]],
+        model_name: str = "",
+    ) -> SharedSnapshot:
+        # returns read-only views into the new segment
+        with self.lock():
+            previous = self.generation()
+            generation = previous + 1
+            dtype = matrix.dtype.name.encode()
+            classes = json.dumps({str(k): v for k, v in class_of.items()}).encode()
+            rows, dim = matrix.shape[0], matrix.shape[1] if matrix.ndim == 2 else 0
+            protos = proto_ids.shape[0]
+            arrays = [student_ids, scales, matrix, proto_ids, proto_scales, proto_matrix]
+            size = _align(_HEADER.size + len(dtype))
+            for array in arrays:
+                size = _align(size + array.nbytes)
+            size += len(classes)
+            segment = shared_memory.SharedMemory(name=f"{self.name}_{generation}", create=True, size=max(1, size))
+            _untrack(segment)
+            _HEADER.pack_into(segment.buf, 0, rows, dim, protos, len(dtype), len(classes))
+            segment.buf[_HEADER.size : _HEADER.size + len(dtype)] = dtype
+            offset = _align(_HEADER.size + len(dtype))
+            for array in arrays:
+                # copy straight into the mapping, no intermediate bytes object
+                target = np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf, offset=offset)
+                np.copyto(target, array)
+                offset = _align(offset + array.nbytes)
+            segment.buf[offset : offset + len(classes)] = classes
+            _CONTROL.pack_into(
+                self._control.buf, 0, _CONTROL_TAG, generation, rows, int(student_ids.sum()), dim, dtype, model_name.encode()
+            )
+            # mappings already held by other workers stay valid after unlink
+            self._unlink(previous)
+            self.publishes += 1
+            return self._attach(segment, generation)
+
+    def _unlink(self, generation: int) -> None:
+        if generation <= 0:
+            return
+        try:
+            old = shared_memory.SharedMemory(name=f"{self.name}_{generation}")
+        except FileNotFoundError:
+            return
+        old.close()
+        # unlink() also drops the resource tracker registration made by the attach
+        old.unlink()
+
+    def adopt(self) -> Optional[SharedSnapshot]:
+        # map the current generation; None if nothing was published yet
+        for _ in range(3):
+            generation = self.generation()
+            if generation <= 0:
+                return None
+            try:
+                segment = shared_memory.SharedMemory(name=f"{self.name}_{generation}")
+            except FileNotFoundError:
+                # superseded between reading the control block and attaching
+                continue
+            _untrack(segment)
+            self.adoptions += 1
+            return self._attach(segment, generation)
+        return None
+
+    def _attach(self, segment: shared_memory.SharedMemory, generation: int) -> SharedSnapshot:
+        baseline = sys.getrefcount(segment._mmap)  # type: ignore[attr-defined]
+        rows, dim, protos, dtype_len, classes_len = _HEADER.unpack_from(segment.buf, 0)
+        dtype = np.dtype(bytes(segment.buf[_HEADER.size : _HEADER.size + dtype_len]).decode())
+        offset = _align(_HEADER.size + dtype_len)
+        views = []
+        for count, item_dtype in (
+            (rows, np.int64),
+            (rows, np.float32),
+            (rows * dim, dtype),
+            (protos, np.int64),
+            (protos, np.float32),
+            (protos * dim, dtype),
+        ):
+            array = np.ndarray((count,), dtype=item_dtype, buffer=segment.buf, offset=offset)
+            array.flags.writeable = False
+            views.append(array)
+            offset = _align(offset + array.nbytes)
+        class_of = {int(k): v for k, v in json.loads(bytes(segment.buf[offset : offset + classes_len]) or b"{}").items()}
+        if self._segment is not None:
+            self._retired.append(self._segment)
+        self._segment = (segment, baseline)
+        self._release_retired()
+        return SharedSnapshot(
+            generation=generation,
+            student_ids=views[0],
+            scales=views[1],
+            matrix=views[2].reshape(rows, dim),
+            proto_ids=views[3],
+            proto_scales=views[4],
+            proto_matrix=views[5].reshape(protos, dim),
+            class_of=class_of,
+        )
+
+    def _release_retired(self) -> None:
+        # A mapping can only be closed once no array views into it remain. numpy
+        # does not hold a buffer export on it (close() would succeed and leave the
+        # views dangling), but every view keeps a reference to the mmap object.
+        still_mapped = []
+        for old, baseline in self._retired:
+            if sys.getrefcount(old._mmap) > baseline:  # type: ignore[attr-defined]
+                still_mapped.append((old, baseline))
+                continue
+            try:
+                old.close()
+            except BufferError:
+                still_mapped.append((old, baseline))
+        self._retired = still_mapped
+
+    def matches(self, rows: int, id_sum: int, dtype: str, model_name: str, dim: Optional[int] = None) -> bool:
+        generation, stored_rows, stored_sum, stored_dim, stored_dtype, stored_model = self.state()
+        if generation <= 0 or stored_rows != rows or stored_sum != id_sum:
+            return False
+        if stored_dtype != dtype or stored_model != model_name[:32]:
+            return False
+        return dim is None or rows == 0 or stored_dim == dim
+
+    def stats(self) -> Dict[str, int]:
+        generation, rows = self.state()[:2]
+        return {"generation": generation, "rows": rows, "publishes": self.publishes, "adoptions": self.adoptions}
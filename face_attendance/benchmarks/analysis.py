@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+import argparse
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from app.face_engine import FaceEngine, cv2
+
+
+def _load(paths: List[str]) -> List[np.ndarray]:
+    images = []
+    for path in paths:
+        image = cv2.imread(path) if cv2 is not None else None
+        if image is None:
+            raise SystemExit(f"Could not read image: {path}")
+        images.append(image)
+    return images
+
+
+def _report(name: str, timings: Dict[str, float], total: float, frames: int) -> None:
+    print(f"{name}: {total * 1000.0 / frames:.2f} ms/frame")
+    for stage, seconds in sorted(timings.items()):
+        print(f"  {stage:<14} {seconds * 1000.0 / frames:8.2f} ms/frame")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare the legacy and single-detection frame analysis paths")
+    parser.add_argument("images", nargs="+", help="face images (BGR-readable by OpenCV)")
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    engine = FaceEngine()
+    engine.startup()
+    images = _load(args.images)
+    frames = len(images) * args.rounds
+
+    # warm-up so model initialisation is not timed
+    engine.analyze_frame_legacy("warmup", images[0])
+    engine.analyze_frames_batch([("warmup", images[0])])
+
+    legacy: Dict[str, float] = {}
+    start = time.perf_counter()
+    for _ in range(args.rounds):
+        for image in images:
+            engine.analyze_frame_legacy("bench-legacy", image, legacy)
+    _report("legacy (full-frame mesh + FaceAnalysis.get)", legacy, time.perf_counter() - start, frames)
+
+    shared: Dict[str, float] = {}
+    start = time.perf_counter()
+    for _ in range(args.rounds):
+        for image in images:
+            engine.analyze_frames_batch([("bench-shared", image)], shared)
+    _report("shared detection", shared, time.perf_counter() - start, frames)
+
+    batched: Dict[str, float] = {}
+    start = time.perf_counter()
+    for _ in range(args.rounds):
+        engine.analyze_frames_batch([(f"bench-batch-{i}", image) for i, image in enumerate(images)], batched)
+    _report(f"shared detection, batch of {len(images)}", batched, time.perf_counter() - start, frames)
+    engine.shutdown()
+
+
+if __name__ == "__main__":
+    main()
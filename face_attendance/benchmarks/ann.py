@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+import argparse
+import time
+
+import numpy as np
+
+from app.ann import IVFIndex
+
+
+def _synthetic(students: int, per_student: int, dim: int, noise: float, seed: int = 0):
+    # clustered unit vectors: one identity centre per student plus per-photo noise
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(students, dim)).astype(np.float32)
+    centres /= np.linalg.norm(centres, axis=1, keepdims=True)
+    ids = np.repeat(np.arange(students), per_student)
+    rows = centres[ids] + noise * rng.normal(size=(ids.shape[0], dim)).astype(np.float32) / np.sqrt(dim)
+    rows /= np.linalg.norm(rows, axis=1, keepdims=True)
+    return centres, rows.astype(np.float32), ids
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Recall and latency of the IVF gallery index against exact search")
+    parser.add_argument("--students", type=int, default=20000)
+    parser.add_argument("--per-student", type=int, default=5)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--noise", type=float, default=0.6)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    args = parser.parse_args()
+
+    centres, matrix, ids = _synthetic(args.students, args.per_student, args.dim, args.noise)
+    rng = np.random.default_rng(1)
+    truth_ids = rng.choice(args.students, size=args.queries)
+    probes = centres[truth_ids] + args.noise * rng.normal(size=(args.queries, args.dim)).astype(np.float32) / np.sqrt(args.dim)
+    probes = (probes / np.linalg.norm(probes, axis=1, keepdims=True)).astype(np.float32)
+    print(f"gallery rows: {matrix.shape[0]}, dim: {args.dim}, queries: {args.queries}")
+
+    start = time.perf_counter()
+    exact_rows = np.array([int(np.argmax(matrix @ probe)) for probe in probes])
+    exact_ms = (time.perf_counter() - start) * 1000.0 / args.queries
+    print(f"exact        {exact_ms:8.3f} ms/query  recall@1 1.000  identity acc {np.mean(ids[exact_rows] == truth_ids):.3f}")
+
+    start = time.perf_counter()
+    index = IVFIndex.train(matrix)
+    print(f"ivf train    {time.perf_counter() - start:8.2f} s ({index.centroids.shape[0]} lists)")
+    for nprobe in args.nprobe:
+        probe_index = IVFIndex(index.centroids, index.assign, nprobe, index.trained_rows)
+        start = time.perf_counter()
+        rows = np.array([probe_index.search(matrix, probe[None, :])[0][0] for probe in probes])
+        ms = (time.perf_counter() - start) * 1000.0 / args.queries
+        recall = float(np.mean(ids[rows] == ids[exact_rows]))
+        print(f"ivf nprobe={nprobe:<3} {ms:8.3f} ms/query  recall@1 {recall:.3f}  speedup {exact_ms / ms:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+import argparse
+import time
+
+import numpy as np
+
+from app.gallery import EmbeddingGallery
+from app.quantize import DTYPES
+
+from .ann import _synthetic
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Memory, latency and accuracy of quantized galleries vs float32")
+    parser.add_argument("--students", type=int, default=5000)
+    parser.add_argument("--per-student", type=int, default=5)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--noise", type=float, default=1.2)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--threshold", type=float, default=0.45)
+    args = parser.parse_args()
+
+    centres, matrix, ids = _synthetic(args.students, args.per_student, args.dim, args.noise)
+    rng = np.random.default_rng(1)
+    truth = rng.choice(args.students, size=args.queries)
+    probes = centres[truth] + args.noise * rng.normal(size=(args.queries, args.dim)).astype(np.float32) / np.sqrt(args.dim)
+    probes = list((probes / np.linalg.norm(probes, axis=1, keepdims=True)).astype(np.float32))
+    impostors = (truth + 1 + rng.integers(0, args.students - 1, size=args.queries)) % args.students
+    print(f"gallery rows: {matrix.shape[0]}, dim: {args.dim}, queries: {args.queries}")
+
+    reference = None
+    for dtype in DTYPES:
+        gallery = EmbeddingGallery(dtype=dtype, index_kind="exact")
+        for student in range(args.students):
+            gallery.add(student, list(matrix[ids == student]))
+        gallery.best_matches(probes[:8])
+        start = time.perf_counter()
+        matches = gallery.best_matches(probes)
+        ms = (time.perf_counter() - start) * 1000.0 / args.queries
+        top1 = np.array([m.student_id for m in matches])
+        best = np.array([m.similarity for m in matches])
+
+        # verification: probe vs best row of its own identity (genuine) and of another (impostor)
+        genuine = np.array([np.max(gallery.student_vectors(int(s))[0] @ p) for s, p in zip(truth, probes)])
+        impostor = np.array([np.max(gallery.student_vectors(int(s))[0] @ p) for s, p in zip(impostors, probes)])
+        accuracy = (np.mean(genuine >= args.threshold) + np.mean(impostor < args.threshold)) / 2.0
+        if reference is None:
+            reference = (top1, best, accuracy)
+        agree = np.mean(top1 == reference[0])
+        drift = np.max(np.abs(best - reference[1]))
+        print(
+            f"{dtype:<8} {gallery.index_stats()['matrix_bytes'] / 1e6:7.2f} MB  {ms:7.3f} ms/query  "
+            f"top-1 acc {np.mean(top1 == truth):.4f}  agree {agree:.4f}  max |d score| {drift:.5f}  "
+            f"verif acc {accuracy:.4f} ({accuracy - reference[2]:+.4f})"
+        )
+
+
+if __name__ == "__main__":
+    main()
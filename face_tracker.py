@@ -0,0 +1,131 @@
+"""
+Lightweight IoU face tracker for Face Recognition Attendance System
+
+Faces are associated between frames by bounding-box overlap so a student who
+has already been identified keeps their identity without running the face
+encoder again until the track is due for re-verification.
+"""
+
+import itertools
+import threading
+import time
+
+
+def box_iou(a, b):
+    """Intersection over union of two (top, right, bottom, left) boxes"""
+    top = max(a[0], b[0])
+    right = min(a[1], b[1])
+    bottom = min(a[2], b[2])
+    left = max(a[3], b[3])
+    inter = max(0, right - left) * max(0, bottom - top)
+    if inter == 0:
+        return 0.0
+    area_a = (a[1] - a[3]) * (a[2] - a[0])
+    area_b = (b[1] - b[3]) * (b[2] - b[0])
+    return inter / float(area_a + area_b - inter)
+
+
+class Track:
+    """A face followed across frames"""
+
+    def __init__(self, track_id, box):
+        self.track_id = track_id
+        self.box = box
+        self.student_id = None
+        self.distance = None
+        self.confirmed = False
+        self.last_verified = 0.0
+        self.misses = 0
+
+    @property
+    def name(self):
+        return self.student_id if self.student_id is not None else "Unknown"
+
+
+class FaceTracker:
+    """Greedy IoU tracker deciding which faces need to be (re-)encoded.
+
+    A track whose match distance is within ``confirm_tolerance`` is confirmed
+    and only re-encoded every ``reverify_seconds``; unconfirmed tracks are
+    encoded on every frame. Tracks unseen for ``max_misses`` frames are dropped.
+    """
+
+    def __init__(self, iou_threshold=0.3, max_misses=5, reverify_seconds=2.0, confirm_tolerance=0.5):
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.reverify_seconds = reverify_seconds
+        self.confirm_tolerance = confirm_tolerance
+        self._tracks = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._last_seq = None
+        self.faces_seen = 0
+        self.encoder_calls = 0
+
+    def update(self, boxes, now=None, seq=None):
+        """Associate this frame's boxes with tracks.
+
+        Returns one track per box (in the same order) and the indices of the
+        boxes whose faces should be encoded. ``seq`` is the frame's capture
+        sequence number; a frame no newer than the last one applied returns
+        (None, None) and leaves the tracks alone.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if seq is not None:
+                if self._last_seq is not None and seq <= self._last_seq:
+                    return None, None
+                self._last_seq = seq
+            pairs = []
+            for ti, track in enumerate(self._tracks):
+                for bi, box in enumerate(boxes):
+                    iou = box_iou(track.box, box)
+                    if iou >= self.iou_threshold:
+                        pairs.append((iou, ti, bi))
+            pairs.sort(reverse=True)
+
+            assigned = [None] * len(boxes)
+            used_tracks = set()
+            for _, ti, bi in pairs:
+                if ti in used_tracks or assigned[bi] is not None:
+                    continue
+                used_tracks.add(ti)
+                track = self._tracks[ti]
+                track.box = boxes[bi]
+                track.misses = 0
+                assigned[bi] = track
+
+            for ti, track in enumerate(self._tracks):
+                if ti not in used_tracks:
+                    track.misses += 1
+            self._tracks = [t for t in self._tracks if t.misses <= self.max_misses]
+
+            for bi, box in enumerate(boxes):
+                if assigned[bi] is None:
+                    track = Track(next(self._ids), box)
+                    self._tracks.append(track)
+                    assigned[bi] = track
+
+            to_encode = [bi for bi, track in enumerate(assigned)
+                         if not track.confirmed or now - track.last_verified >= self.reverify_seconds]
+            self.faces_seen += len(boxes)
+            self.encoder_calls += len(to_encode)
+            return assigned, to_encode
+
+    def set_identity(self, track, student_id, distance, now=None):
+        """Record the result of encoding and matching a track's face"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            track.student_id = student_id
+            track.distance = distance
+            track.confirmed = student_id is not None and distance is not None and distance <= self.confirm_tolerance
+            track.last_verified = now
+
+    def stats(self):
+        with self._lock:
+            return {
+                'active_tracks': len(self._tracks),
+                'confirmed_tracks': sum(1 for t in self._tracks if t.confirmed),
+                'faces_seen': self.faces_seen,
+                'encoder_calls': self.encoder_calls,
+            }
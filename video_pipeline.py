@@ -0,0 +1,279 @@
+"""
+Threaded live-feed pipeline for Face Recognition Attendance System
+
+Capture, recognition and annotation/JPEG encoding run on separate threads
+connected by small bounded queues. When a stage falls behind, the oldest
+queued frame is dropped so the stream always shows the most recent picture.
+"""
+
+import threading
+import time
+from collections import deque
+
+import cv2
+
+
+class LatestFrameQueue:
+    """Bounded queue that discards the oldest item when full"""
+
+    def __init__(self, maxsize=1):
+        self._items = deque()
+        self._maxsize = maxsize
+        self._cond = threading.Condition()
+        self._closed = False
+        self.put_count = 0
+        self.dropped = 0
+
+    def put(self, item):
+        with self._cond:
+            if len(self._items) >= self._maxsize:
+                self._items.popleft()
+                self.dropped += 1
+            self._items.append(item)
+            self.put_count += 1
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """Return the next item, or None on timeout or once the queue is closed"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._items or self._closed, timeout):
+                return None
+            if not self._items:
+                return None
+            return self._items.popleft()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def __len__(self):
+        with self._cond:
+            return len(self._items)
+
+
+class FrameBroadcaster:
+    """Holds the latest encoded JPEG and wakes every waiting client on update"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._seq = -1
+        self._jpeg = None
+        self._closed = False
+
+    def publish(self, seq, jpeg):
+        with self._cond:
+            self._seq = seq
+            self._jpeg = jpeg
+            self._cond.notify_all()
+
+    def wait(self, last_seq, timeout=1.0):
+        """Block until a frame newer than ``last_seq`` is available.
+
+        Returns (seq, jpeg); jpeg is None on timeout and seq is None once closed.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > last_seq or self._closed, timeout)
+            if self._seq > last_seq:
+                return self._seq, self._jpeg
+            if self._closed:
+                return None, None
+            return last_seq, None
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class VideoPipeline:
+    """Capture -> recognize -> annotate/encode pipeline over a camera.
+
+    ``recognize(frame, seq)`` returns detections for a BGR frame and runs on
+    ``workers`` threads; it returns None to skip a frame that finished after a
+    newer one. ``annotate(frame, detections)`` draws them. Capture is paced to
+    ``frame_rate`` frames per second.
+    """
+
+    def __init__(self, recognize, annotate, camera_index=0, frame_rate=30, workers=2,
+                 frame_width=None, frame_height=None, queue_size=1):
+        self.recognize = recognize
+        self.annotate = annotate
+        self.camera_index = camera_index
+        self.frame_rate = frame_rate
+        self.workers = max(1, int(workers))
+        self.frame_width = frame_width
+        self.frame_height = frame_height
+
+        self.capture_queue = LatestFrameQueue(queue_size)
+        self.result_queue = LatestFrameQueue(max(queue_size, self.workers))
+        self.output = FrameBroadcaster()
+
+        self._camera = None
+        self._threads = []
+        self._stop = threading.Event()
+        # held for the whole start/stop transition
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._seq = 0
+        self._last_annotated_seq = -1
+        self._stale_results = 0
+        self._processed = {'capture': 0, 'recognize': 0, 'annotate': 0}
+        self._errors = {'recognize': 0, 'annotate': 0}
+        self._out_of_order = {'recognize': 0}
+
+    @property
+    def running(self):
+        return bool(self._threads) and not self._stop.is_set()
+
+    def start(self):
+        """Open the camera and start every stage thread (idempotent)"""
+        with self._lock:
+            if self._threads and not self._stop.is_set():
+                return
+            self._stop.clear()
+            self.capture_queue = LatestFrameQueue(self.capture_queue._maxsize)
+            self.result_queue = LatestFrameQueue(self.result_queue._maxsize)
+            self.output = FrameBroadcaster()
+            self._camera = cv2.VideoCapture(self.camera_index)
+            if self.frame_width:
+                self._camera.set(cv2.CAP_PROP_FRAME_WIDTH, self.frame_width)
+            if self.frame_height:
+                self._camera.set(cv2.CAP_PROP_FRAME_HEIGHT, self.frame_height)
+
+            threads = []
+            threads.append(threading.Thread(target=self._capture_loop, args=(threads,), name='pipeline-capture', daemon=True))
+            for i in range(self.workers):
+                threads.append(threading.Thread(target=self._recognize_loop, name=f'pipeline-recognize-{i}', daemon=True))
+            threads.append(threading.Thread(target=self._annotate_loop, name='pipeline-annotate', daemon=True))
+            self._threads = threads
+            for thread in threads:
+                thread.start()
+
+    def stop(self, threads=None):
+        """Stop all stages and release the camera.
+
+        With ``threads`` only that run is stopped, so a late stop from an old
+        capture thread cannot tear down a pipeline started after it.
+        """
+        with self._lock:
+            if threads is not None and threads is not self._threads:
+                return
+            self._stop.set()
+            self.capture_queue.close()
+            self.result_queue.close()
+            self.output.close()
+            for thread in self._threads:
+                if thread is not threading.current_thread():
+                    thread.join(timeout=2.0)
+            self._threads = []
+            if self._camera is not None:
+                self._camera.release()
+                self._camera = None
+
+    def _count(self, counters, stage):
+        with self._stats_lock:
+            counters[stage] += 1
+
+    def _capture_loop(self, threads):
+        interval = 1.0 / self.frame_rate if self.frame_rate else 0.0
+        next_due = time.monotonic()
+        while not self._stop.is_set():
+            success, frame = self._camera.read()
+            if not success:
+                break
+            self._seq += 1
+            self._count(self._processed, 'capture')
+            self.capture_queue.put((self._seq, frame))
+            if interval:
+                next_due += interval
+                delay = next_due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_due = time.monotonic()
+        # Camera gone: let the other stages and the HTTP clients finish
+        threading.Thread(target=self.stop, args=(threads,), daemon=True).start()
+
+    def _recognize_loop(self):
+        while not self._stop.is_set():
+            item = self.capture_queue.get(timeout=0.5)
+            if item is None:
+                continue
+            seq, frame = item
+            try:
+                detections = self.recognize(frame, seq)
+            except Exception as e:
+                self._count(self._errors, 'recognize')
+                print(f"Recognition error: {e}")
+                detections = []
+            if detections is None:
+                self._count(self._out_of_order, 'recognize')
+                continue
+            self._count(self._processed, 'recognize')
+            self.result_queue.put((seq, frame, detections))
+
+    def _annotate_loop(self):
+        while not self._stop.is_set():
+            item = self.result_queue.get(timeout=0.5)
+            if item is None:
+                continue
+            seq, frame, detections = item
+            # With several recognition workers results can arrive out of order
+            if seq <= self._last_annotated_seq:
+                self._stale_results += 1
+                continue
+            self._last_annotated_seq = seq
+            try:
+                self.annotate(frame, detections)
+                ret, buffer = cv2.imencode('.jpg', frame)
+            except Exception as e:
+                self._count(self._errors, 'annotate')
+                print(f"Annotation error: {e}")
+                continue
+            if ret:
+                self._count(self._processed, 'annotate')
+                self.output.publish(seq, buffer.tobytes())
+
+    def frames(self):
+        """Yield multipart JPEG chunks for an HTTP client until the pipeline stops"""
+        self.start()
+        output = self.output
+        last_seq = -1
+        while True:
+            seq, jpeg = output.wait(last_seq)
+            if seq is None:
+                break
+            if jpeg is None:
+                continue
+            last_seq = seq
+            yield (b'--frame\r\n'
+                   b'Content-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n')
+
+    def stats(self):
+        """Per-stage queue depth, throughput and drop counts"""
+        with self._stats_lock:
+            processed = dict(self._processed)
+            errors = dict(self._errors)
+            out_of_order = self._out_of_order['recognize']
+        return {
+            'running': self.running,
+            'workers': self.workers,
+            'frame_rate': self.frame_rate,
+            'capture': {
+                'frames': processed['capture'],
+            },
+            'recognize': {
+                'queue_depth': len(self.capture_queue),
+                'processed': processed['recognize'],
+                'dropped': self.capture_queue.dropped,
+                'errors': errors['recognize'],
+                'out_of_order': out_of_order,
+            },
+            'annotate': {
+                'queue_depth': len(self.result_queue),
+                'processed': processed['annotate'],
+                'dropped': self.result_queue.dropped + self._stale_results,
+                'errors': errors['annotate'],
+            },
+        }